@@ -10,9 +10,10 @@ import pkg_resources
 
 from . import utils, driver
 
-from .file import File
+from .file import File, FileRecord, memory_map
+from .table import FileTable
 from .database import Database, SQLiteBaseDatabase, SQLiteDatabase, FileDatabase
-from .annotations import read_annotation_file
+from .annotations import read_annotation_file, read_annotation_files
 __version__ = pkg_resources.require(__name__)[0].version
 
 
@@ -39,10 +40,14 @@ def __appropriate__(*args):
 
 __appropriate__(
     File,
+    FileRecord,
+    FileTable,
     Database,
     FileDatabase,
     SQLiteDatabase,
     SQLiteBaseDatabase,
     read_annotation_file,
+    read_annotation_files,
+    memory_map,
     )
 __all__ = [_ for _ in dir() if not _.startswith('_')]
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Runs database queries and file I/O from :py:mod:`asyncio` code.
+
+Blocking calls are run in two dedicated thread pools, one for SQL queries and
+one for file I/O, so that slow storage does not starve queries and neither
+blocks the event loop. The number of threads of each pool bounds the number
+of calls running concurrently and can be changed with :py:func:`configure`.
+
+If the awaiting task is cancelled, calls that did not start yet are dropped.
+Calls that are already running cannot be interrupted: they complete in the
+background and their results are discarded.
+"""
+
+import asyncio
+import functools
+import threading
+import concurrent.futures
+
+
+_sizes = {'sql': 4, 'io': 16}
+_executors = {}
+_lock = threading.Lock()
+
+
+def configure(sql_workers=None, io_workers=None):
+  """Sets the number of threads used for SQL queries and for file I/O
+
+  Executors that are already running are shut down (after finishing their
+  pending calls) and are re-created with the new sizes on their next use.
+
+  Parameters
+  ----------
+  sql_workers : :obj:`int`, optional
+      The number of SQL queries run concurrently.
+  io_workers : :obj:`int`, optional
+      The number of files read or written concurrently.
+  """
+
+  with _lock:
+    for kind, size in (('sql', sql_workers), ('io', io_workers)):
+      if size is None:
+        continue
+      if size <= 0:
+        raise ValueError("The number of %s workers must be positive, not %d"
+                         % (kind, size))
+      _sizes[kind] = size
+      executor = _executors.pop(kind, None)
+      if executor is not None:
+        executor.shutdown(wait=False)
+
+
+def executor(kind):
+  """Returns the executor for ``sql`` or ``io`` calls, creating it if needed
+  """
+
+  with _lock:
+    if kind not in _executors:
+      _executors[kind] = concurrent.futures.ThreadPoolExecutor(
+          max_workers=_sizes[kind],
+          thread_name_prefix='bob.db.base.%s' % kind)
+    return _executors[kind]
+
+
+def shutdown(wait=True):
+  """Shuts all executors down, they are re-created on their next use"""
+
+  with _lock:
+    executors = list(_executors.values())
+    _executors.clear()
+  for e in executors:
+    e.shutdown(wait=wait)
+
+
+async def _run(kind, function, *args, **kwargs):
+  loop = asyncio.get_running_loop()
+  return await loop.run_in_executor(
+      executor(kind), functools.partial(function, *args, **kwargs))
+
+
+async def run_sql(function, *args, **kwargs):
+  """Awaits ``function(*args, **kwargs)``, run in the SQL executor"""
+
+  return await _run('sql', function, *args, **kwargs)
+
+
+async def run_io(function, *args, **kwargs):
+  """Awaits ``function(*args, **kwargs)``, run in the file I/O executor"""
+
+  return await _run('io', function, *args, **kwargs)
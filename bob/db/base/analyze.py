@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Tools to inspect query plans and add missing indexes to SQLite databases.
+
+Representative queries of a database (typically, calls to its ``objects()``
+method) are run while recording the SQL statements they execute. Each
+statement is then explained with ``EXPLAIN QUERY PLAN`` to find tables that
+are fully scanned, and the columns used to filter or join those tables are
+suggested for indexing. For example, from the ``create`` step of a database
+package:
+
+.. code-block:: python
+
+   from bob.db.base.analyze import optimize
+   db = Database()
+   optimize(sqlite_file, [db.objects, lambda: db.objects(groups='dev')])
+"""
+
+import re
+import logging
+import collections
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+
+QueryPlan = collections.namedtuple(
+    'QueryPlan', ('statement', 'details', 'scans', 'suggestions'))
+"""The plan of a recorded statement.
+
+The fields are the SQL ``statement``, the ``details`` of each step of its
+plan, the names of the fully scanned tables (``scans``) and the
+``(table, column)`` pairs suggested for indexing (``suggestions``)."""
+
+
+_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?')
+
+
+@contextlib.contextmanager
+def record_statements():
+  """Records the ``SELECT`` statements executed by any SQLAlchemy engine
+
+  Yields
+  ------
+  list
+      A list, filled while the context is active, of ``(statement,
+      parameters, clause)`` tuples, where ``clause`` is the SQLAlchemy
+      expression the statement was compiled from, if any.
+  """
+
+  from sqlalchemy import event
+  from sqlalchemy.engine import Engine
+
+  statements = []
+
+  def record(conn, cursor, statement, parameters, context, executemany):
+    if executemany or not statement.lstrip().upper().startswith('SELECT'):
+      return
+    compiled = getattr(context, 'compiled', None)
+    clause = compiled.statement if compiled is not None else None
+    statements.append((statement, parameters, clause))
+
+  event.listen(Engine, 'before_cursor_execute', record)
+  try:
+    yield statements
+  finally:
+    event.remove(Engine, 'before_cursor_execute', record)
+
+
+def explain(connection, statement, parameters=()):
+  """Returns the details of the query plan of a statement
+
+  Parameters
+  ----------
+  connection : :py:class:`sqlite3.Connection`
+      A connection to the SQLite database.
+  statement : str
+      The SQL statement to explain.
+  parameters : :obj:`tuple`, optional
+      The parameters bound to the statement.
+
+  Returns
+  -------
+  list of :obj:`str`
+      The details of each step of the plan, as reported by SQLite.
+  """
+
+  cursor = connection.execute('EXPLAIN QUERY PLAN ' + statement,
+                              parameters or ())
+  return [row[-1] for row in cursor.fetchall()]
+
+
+def full_scans(details):
+  """Returns the names of the tables fully scanned by a query plan
+
+  Parameters
+  ----------
+  details : list of :obj:`str`
+      The details of a query plan, as returned by :py:func:`explain`.
+
+  Returns
+  -------
+  list of :obj:`str`
+      The names (or aliases) of the scanned tables.
+  """
+
+  scans = []
+  for detail in details:
+    match = _SCAN.match(detail)
+    if match is None or 'USING' in detail:
+      continue
+    if match.group(1) in ('CONSTANT', 'SUBQUERY'):
+      continue
+    scans.append(match.group(2) or match.group(1))
+  return scans
+
+
+def _join_conditions(element):
+  """Returns the ``ON`` clauses of the joins in the ``FROM`` list of a
+  ``SELECT`` statement"""
+
+  from sqlalchemy.sql.expression import Join
+
+  froms = getattr(element, 'get_final_froms', None)
+  froms = froms() if froms is not None else getattr(element, 'froms', ())
+  conditions = []
+  pending = list(froms)
+  while pending:
+    source = pending.pop()
+    if isinstance(source, Join):
+      if source.onclause is not None:
+        conditions.append(source.onclause)
+      pending.extend((source.left, source.right))
+  return conditions
+
+
+def _elements(clause):
+  """Iterates over the elements of an expression, including the conditions
+  of its joins, which are not reached by
+  :py:func:`sqlalchemy.sql.visitors.iterate`"""
+
+  from sqlalchemy.sql import visitors
+  from sqlalchemy.sql.expression import Select
+
+  pending = [clause]
+  seen = set()
+  while pending:
+    for element in visitors.iterate(pending.pop()):
+      if id(element) in seen:
+        continue
+      seen.add(id(element))
+      yield element
+      if isinstance(element, Select):
+        pending.extend(_join_conditions(element))
+
+
+def filtered_columns(clause):
+  """Returns the columns compared in the filters or joins of an expression
+
+  Parameters
+  ----------
+  clause : :py:class:`sqlalchemy.sql.expression.ClauseElement`
+      The SQLAlchemy expression of a ``SELECT`` statement.
+
+  Returns
+  -------
+  dict
+      A dictionary mapping the names and aliases of tables to the set of
+      their columns compared with other values. Columns are given as
+      ``(table, column)`` pairs, using the real name of the table.
+  """
+
+  from sqlalchemy.sql.expression import BinaryExpression
+  from sqlalchemy.schema import Column
+
+  columns = collections.defaultdict(set)
+  for element in _elements(clause):
+    if not isinstance(element, BinaryExpression):
+      continue
+    for side in (element.left, element.right):
+      table = getattr(side, 'table', None)
+      if table is None or not isinstance(side, Column):
+        continue
+      # aliased tables point to the original one
+      original = getattr(table, 'element', table)
+      name = getattr(original, 'name', None)
+      if name is None:
+        continue
+      columns[name].add((name, side.name))
+      if table.name != name and '%(' not in table.name:
+        # explicitly named alias
+        columns[table.name].add((name, side.name))
+  return columns
+
+
+def indexed_columns(connection, table):
+  """Returns the columns of a table that lead an index or are the primary
+  key"""
+
+  quoted = '"%s"' % table.replace('"', '""')
+  indexed = set(row[1] for row in connection.execute(
+      'PRAGMA table_info(%s)' % quoted) if row[5])
+  for index in connection.execute('PRAGMA index_list(%s)' % quoted).fetchall():
+    info = connection.execute(
+        'PRAGMA index_info("%s")' % index[1].replace('"', '""')).fetchall()
+    indexed.update(row[2] for row in info if row[0] == 0)
+  return indexed
+
+
+def explain_queries(sqlite_file, calls):
+  """Runs representative queries and explains the statements they execute
+
+  Parameters
+  ----------
+  sqlite_file : str
+      The SQLite file the queries run on.
+  calls : list of callables
+      Functions without arguments running representative queries, e.g.,
+      ``lambda: db.objects(protocol='P')``.
+
+  Returns
+  -------
+  list of :py:data:`QueryPlan`
+      The plans of all distinct statements executed by the calls.
+  """
+
+  with record_statements() as statements:
+    for call in calls:
+      call()
+
+  from .utils import SQLiteConnector
+
+  connection = SQLiteConnector(sqlite_file, readonly=True, lock='unix-none')()
+  try:
+    plans = []
+    seen = set()
+    for statement, parameters, clause in statements:
+      if statement in seen:
+        continue
+      seen.add(statement)
+      details = explain(connection, statement, parameters)
+      scans = full_scans(details)
+      suggestions = set()
+      if scans and clause is not None:
+        columns = filtered_columns(clause)
+        for scanned in scans:
+          if scanned not in columns:
+            # anonymous aliases are rendered as <table>_<number>
+            scanned = re.sub(r'_\d+$', '', scanned)
+          for table, column in columns.get(scanned, ()):
+            if column not in indexed_columns(connection, table):
+              suggestions.add((table, column))
+      plans.append(QueryPlan(statement, details, scans, sorted(suggestions)))
+    return plans
+  finally:
+    connection.close()
+
+
+def create_indexes(sqlite_file, columns, analyze=True):
+  """Creates single-column indexes and updates the statistics of a database
+
+  Parameters
+  ----------
+  sqlite_file : str
+      The SQLite file to modify.
+  columns : list
+      The ``(table, column)`` pairs to index.
+  analyze : :obj:`bool`, optional
+      If set, ``ANALYZE`` is run afterwards, so the query planner can use the
+      statistics of the new indexes.
+
+  Returns
+  -------
+  list of :obj:`str`
+      The names of the indexes created.
+  """
+
+  from .utils import SQLiteConnector
+
+  connection = SQLiteConnector(sqlite_file, lock='unix-none')()
+  try:
+    created = []
+    for table, column in columns:
+      name = 'ix_%s_%s' % (table, column)
+      logger.info("Creating index %s on %s(%s)", name, table, column)
+      connection.execute('CREATE INDEX IF NOT EXISTS "%s" ON "%s" ("%s")' %
+                         (name, table, column))
+      created.append(name)
+    if analyze:
+      connection.execute('ANALYZE')
+    connection.commit()
+    return created
+  finally:
+    connection.close()
+
+
+def optimize(sqlite_file, calls, analyze=True):
+  """Indexes the columns of fully scanned tables used by the given queries
+
+  This combines :py:func:`explain_queries` and :py:func:`create_indexes`, and
+  can be run at the end of the ``create`` step of a database package.
+
+  Returns
+  -------
+  list of :obj:`str`
+      The names of the indexes created.
+  """
+
+  plans = explain_queries(sqlite_file, calls)
+  columns = sorted(set(c for plan in plans for c in plan.suggestions))
+  return create_indexes(sqlite_file, columns, analyze)
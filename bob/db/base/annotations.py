@@ -1,11 +1,15 @@
 #!/usr/bin/env python
 # vim: set fileencoding=utf-8 :
 
+import io
 import json
 import logging
 import os
+import tarfile
+import functools
 import collections
 from bob.extension.download import search_file
+from . import utils
 logger = logging.getLogger(__name__)
 
 _idiap_annotations = {
@@ -33,6 +37,75 @@ _idiap_annotations = {
     22: 'chin'
 }
 
+_annotation_types = ('eyecenter', 'named', 'idiap', 'json')
+
+
+def _parse(f, annotation_type, file_name):
+  """Parses the annotations of an opened file, see
+  :py:func:`read_annotation_file`"""
+
+  annotations = {}
+
+  if str(annotation_type) == 'eyecenter':
+    # only the eye positions are written, all are in the first row
+    line = f.readline()
+    positions = line.split()
+    assert len(positions) == 4
+    annotations['reye'] = (float(positions[1]), float(positions[0]))
+    annotations['leye'] = (float(positions[3]), float(positions[2]))
+
+  elif str(annotation_type) == 'named':
+    # multiple lines, no header line, each line contains annotation and
+    # position or single value annotation
+    for line in f:
+      positions = line.split()
+      if len(positions) == 3:
+        annotations[positions[0]] = (
+            float(positions[2]), float(positions[1]))
+      elif len(positions) == 2:
+        annotations[positions[0]] = float(positions[1])
+      else:
+        logger.error(
+            "Could not interpret line '%s' in annotation file '%s'",
+            line, file_name)
+
+  elif str(annotation_type) == 'idiap':
+    # Idiap format: multiple lines, no header, each line contains an integral
+    # keypoint identifier, or other identifier like 'gender', 'age',...
+    for line in f:
+      positions = line.rstrip().split()
+      if positions:
+        if positions[0].isdigit():
+          # position field
+          assert len(positions) == 3
+          id = int(positions[0])
+          annotations[_idiap_annotations[id]] = (
+              float(positions[2]), float(positions[1]))
+        else:
+          # another field, we take the first entry as key and the rest as
+          # values
+          annotations[positions[0]] = positions[1:]
+    # finally, we add the eye center coordinates as the center between the
+    # eye corners; the annotations 3 and 8 are the pupils...
+    if 'reyeo' in annotations and 'reyei' in annotations:
+      annotations['reye'] = ((annotations['reyeo'][0] + annotations['reyei'][0]) /
+                             2., (annotations['reyeo'][1] + annotations['reyei'][1]) / 2.)
+    if 'leyeo' in annotations and 'leyei' in annotations:
+      annotations['leye'] = ((annotations['leyeo'][0] + annotations['leyei'][0]) /
+                             2., (annotations['leyeo'][1] + annotations['leyei'][1]) / 2.)
+
+  elif str(annotation_type) == 'json':
+    annotations = json.load(f, object_pairs_hook=collections.OrderedDict)
+  else:
+    raise ValueError(
+        "The given annotation type '%s' is not known, choose one of ('eyecenter', 'named', 'idiap')" % annotation_type)
+
+  if annotations is not None and 'leye' in annotations and 'reye' in annotations and annotations['leye'][1] < annotations['reye'][1]:
+    logger.warn(
+        "The eye annotations in file '%s' might be exchanged!" % file_name)
+
+  return annotations
+
 
 def read_annotation_file(file_name, annotation_type):
   """This function provides default functionality to read annotation files.
@@ -81,68 +154,159 @@ def read_annotation_file(file_name, annotation_type):
       raise IOError("The annotation file '%s' was not found" % file_name)
     f = open(file_name)
 
-  annotations = {}
-
   try:
+    return _parse(f, annotation_type, file_name)
+  finally:
+    f.close()
 
-    if str(annotation_type) == 'eyecenter':
-      # only the eye positions are written, all are in the first row
-      line = f.readline()
-      positions = line.split()
-      assert len(positions) == 4
-      annotations['reye'] = (float(positions[1]), float(positions[0]))
-      annotations['leye'] = (float(positions[3]), float(positions[2]))
-
-    elif str(annotation_type) == 'named':
-      # multiple lines, no header line, each line contains annotation and
-      # position or single value annotation
-      for line in f:
-        positions = line.split()
-        if len(positions) == 3:
-          annotations[positions[0]] = (
-              float(positions[2]), float(positions[1]))
-        elif len(positions) == 2:
-          annotations[positions[0]] = float(positions[1])
-        else:
-          logger.error(
-              "Could not interpret line '%s' in annotation file '%s'",
-              line, file_name)
-
-    elif str(annotation_type) == 'idiap':
-      # Idiap format: multiple lines, no header, each line contains an integral
-      # keypoint identifier, or other identifier like 'gender', 'age',...
-      for line in f:
-        positions = line.rstrip().split()
-        if positions:
-          if positions[0].isdigit():
-            # position field
-            assert len(positions) == 3
-            id = int(positions[0])
-            annotations[_idiap_annotations[id]] = (
-                float(positions[2]), float(positions[1]))
-          else:
-            # another field, we take the first entry as key and the rest as
-            # values
-            annotations[positions[0]] = positions[1:]
-      # finally, we add the eye center coordinates as the center between the
-      # eye corners; the annotations 3 and 8 are the pupils...
-      if 'reyeo' in annotations and 'reyei' in annotations:
-        annotations['reye'] = ((annotations['reyeo'][0] + annotations['reyei'][0]) /
-                               2., (annotations['reyeo'][1] + annotations['reyei'][1]) / 2.)
-      if 'leyeo' in annotations and 'leyei' in annotations:
-        annotations['leye'] = ((annotations['leyeo'][0] + annotations['leyei'][0]) /
-                               2., (annotations['leyeo'][1] + annotations['leyei'][1]) / 2.)
-
-    elif str(annotation_type) == 'json':
-      annotations = json.load(f, object_pairs_hook=collections.OrderedDict)
-    else:
-      raise ValueError(
-          "The given annotation type '%s' is not known, choose one of ('eyecenter', 'named', 'idiap')" % annotation_type)
+
+def _read_archive(base_path, tails):
+  """Reads the given members of a tarball, opening it only once
+
+  Members are found as in :py:func:`bob.extension.download.search_file`,
+  i.e., the first member whose name ends with the given path, and are read
+  in the order they are stored.
+
+  Returns
+  -------
+  dict
+      The contents of each member that was found, keyed by the given path.
+  """
+
+  with tarfile.open(base_path) as archive:
+    members = [m for m in archive.getmembers() if m.isfile()]
+    by_name = collections.defaultdict(list)
+    for m in members:
+      by_name[os.path.basename(m.name)].append(m)
+    found = {}
+    for tail in set(tails):
+      candidates = by_name.get(os.path.basename(tail), members)
+      member = next((m for m in candidates if m.name.endswith(tail)), None)
+      if member is None and candidates is not members:
+        member = next((m for m in members if m.name.endswith(tail)), None)
+      if member is not None:
+        found[tail] = member
+    contents = {}
+    for tail, member in sorted(found.items(),
+                               key=lambda item: item[1].offset_data):
+      contents[tail] = archive.extractfile(member).read()
+  return contents
+
+
+def _read_one(file_name, annotation_type, contents):
+  """Reads an annotation file, in the workers of
+  :py:func:`read_annotation_files`"""
+
+  if not file_name:
+    return None
+  if file_name in contents:
+    data = contents[file_name]
+    if isinstance(data, Exception):
+      raise data
+    f = io.StringIO(data.decode('utf-8'))
+  elif ":" in file_name:
+    # a directory, archives were read beforehand
+    base_path, tail = file_name.split(":", maxsplit=1)
+    path = os.path.join(base_path, tail)
+    f = open(path) if os.path.isfile(path) else search_file(base_path, [tail])
+  else:
+    if not os.path.exists(file_name):
+      raise IOError("The annotation file '%s' was not found" % file_name)
+    f = open(file_name)
+  if f is None:
+    raise IOError("The annotation file '%s' was not found" % file_name)
+
+  try:
+    return _parse(f, annotation_type, file_name)
   finally:
     f.close()
 
-  if annotations is not None and 'leye' in annotations and 'reye' in annotations and annotations['leye'][1] < annotations['reye'][1]:
-    logger.warn(
-        "The eye annotations in file '%s' might be exchanged!" % file_name)
 
-  return annotations
+def _error_as_result(function, item):
+  """Returns the exception raised by ``function(item)``, if any, instead of
+  raising it"""
+
+  try:
+    return function(item)
+  except Exception as e:
+    return e
+
+
+def read_annotation_files(file_names, annotation_type, workers=None,
+                          on_error='skip'):
+  """Reads many annotation files in parallel.
+
+  This is the bulk version of :py:func:`read_annotation_file`. Each tarball
+  referenced by ``base_path:relative_path`` names is opened once, and the
+  requested files are read from it in the order they are stored. Files are
+  then parsed in parallel.
+
+  Parameters
+  ----------
+  file_names : list of :obj:`str`
+      The paths of the annotation files, as in
+      :py:func:`read_annotation_file`.
+  annotation_type : str
+      The type of the annotation files, see :py:func:`read_annotation_file`.
+  workers : :obj:`int`, optional
+      The number of files read concurrently.
+  on_error : :obj:`str`, optional
+      What to do when a file cannot be read or parsed: ``skip`` logs the
+      error and returns ``None`` for this file, ``return`` returns the
+      exception for this file, while ``raise`` stops and raises the error.
+
+  Returns
+  -------
+  list
+      The annotations of each file, as returned by
+      :py:func:`read_annotation_file`, in the same order as ``file_names``.
+      With ``on_error='return'``, the files that could not be read have an
+      :py:class:`Exception` instead.
+
+  Raises
+  ------
+  ValueError
+      If the annotation type or ``on_error`` is not known.
+  """
+
+  if str(annotation_type) not in _annotation_types:
+    raise ValueError(
+        "The given annotation type '%s' is not known, choose one of %s" %
+        (annotation_type, _annotation_types))
+  if on_error not in ('raise', 'skip', 'return'):
+    raise ValueError("on_error must be one of 'raise', 'skip' or 'return', "
+                     "not '%s'" % on_error)
+  file_names = list(file_names)
+
+  # group the files of each tarball, to read them at once
+  archives = collections.defaultdict(list)
+  for file_name in file_names:
+    if file_name and ":" in file_name:
+      base_path, tail = file_name.split(":", maxsplit=1)
+      archives[base_path].append((file_name, tail))
+  contents = {}
+  for base_path, names in archives.items():
+    if os.path.isdir(base_path):
+      continue
+    try:
+      members = _read_archive(base_path, [tail for _, tail in names])
+    except (tarfile.TarError, IOError, OSError) as e:
+      members = {}
+      error = IOError("The annotation archive '%s' could not be read: %s" %
+                      (base_path, e))
+    else:
+      error = None
+    for file_name, tail in names:
+      if tail in members:
+        contents[file_name] = members[tail]
+      else:
+        contents[file_name] = error or IOError(
+            "The annotation file '%s' was not found" % file_name)
+
+  read = functools.partial(_read_one, annotation_type=annotation_type,
+                           contents=contents)
+  if on_error == 'return':
+    read = functools.partial(_error_as_result, read)
+    on_error = 'raise'
+  return utils.parallel_map(read, file_names, workers=workers,
+                            on_error=on_error)
@@ -0,0 +1,520 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Caches that avoid repeating expensive database queries and file reads.
+"""
+
+import os
+import glob
+import pickle
+import hashlib
+import inspect
+import logging
+import tempfile
+import functools
+import collections
+import threading
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+
+CacheInfo = collections.namedtuple(
+    'CacheInfo', ('hits', 'misses', 'evictions', 'maxsize', 'currsize'))
+"""Statistics of a cache, like :py:func:`functools.lru_cache` reports them"""
+
+
+class FileCache(object):
+  """A bounded identity map of :py:class:`bob.db.base.File` objects.
+
+  Objects are kept by their ``id`` and can be retrieved by ``id`` or by
+  ``path``. When more than ``maxsize`` objects are stored, the least recently
+  used ones are evicted. The cache can be shared between threads. Pickling it
+  only keeps its size, not its contents.
+
+  Parameters
+  ----------
+  maxsize : int
+      The maximum number of objects kept in the cache.
+
+  Attributes
+  ----------
+  hits : int
+      The number of lookups answered from the cache.
+  misses : int
+      The number of lookups that were not found in the cache.
+  evictions : int
+      The number of objects removed to keep the cache within ``maxsize``.
+  """
+
+  def __init__(self, maxsize):
+    if maxsize <= 0:
+      raise ValueError("The cache size must be positive, not %d" % maxsize)
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._by_id = collections.OrderedDict()
+    self._by_path = {}
+    self._lock = threading.Lock()
+
+  def __getstate__(self):
+    return {'maxsize': self.maxsize}
+
+  def __setstate__(self, state):
+    self.__init__(state['maxsize'])
+
+  def __len__(self):
+    return len(self._by_id)
+
+  def get(self, key, attribute='id'):
+    """Returns the cached object for the given key, or ``None``
+
+    Parameters
+    ----------
+    key : object
+        The ``id`` or the ``path`` of the object to return.
+    attribute : str
+        Either ``id`` or ``path``, indicating what ``key`` refers to.
+    """
+
+    with self._lock:
+      if attribute == 'path':
+        key = self._by_path.get(key)
+      f = self._by_id.get(key)
+      if f is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      self._by_id.move_to_end(key)
+      return f
+
+  def put(self, f):
+    """Adds the given object to the cache, evicting old ones if required"""
+
+    with self._lock:
+      old = self._by_id.pop(f.id, None)
+      if old is not None:
+        self._by_path.pop(old.path, None)
+      self._by_id[f.id] = f
+      self._by_path[f.path] = f.id
+      while len(self._by_id) > self.maxsize:
+        _, evicted = self._by_id.popitem(last=False)
+        self._by_path.pop(evicted.path, None)
+        self.evictions += 1
+
+  def clear(self):
+    """Removes all objects from the cache and resets the statistics"""
+
+    with self._lock:
+      self._by_id.clear()
+      self._by_path.clear()
+      self.hits = self.misses = self.evictions = 0
+
+  def info(self):
+    """Returns the cache statistics as a :py:data:`CacheInfo` tuple"""
+
+    return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize,
+                     len(self._by_id))
+
+
+class LoadCache(object):
+  """A memory-budgeted LRU cache of loaded arrays.
+
+  Arrays are kept by the resolved path of the file they were loaded from,
+  together with the modification time and size of the file, so that a
+  modified file is loaded again. When the total size of the cached arrays
+  exceeds ``max_bytes``, the least recently used ones are evicted. Cached
+  arrays are made read-only, so that callers cannot modify them for others;
+  copy them if you need to modify them. Data that are not
+  :py:class:`numpy.ndarray` objects, or that are larger than the budget, are
+  not cached.
+
+  The cache can be shared between threads. Pickling it only keeps its
+  budget, not its contents.
+
+  Parameters
+  ----------
+  max_bytes : int
+      The maximum total size of the cached arrays, in bytes.
+
+  Attributes
+  ----------
+  hits : int
+      The number of loads answered from the cache.
+  misses : int
+      The number of loads that read the file.
+  evictions : int
+      The number of arrays removed to keep the cache within ``max_bytes``.
+  """
+
+  def __init__(self, max_bytes):
+    if max_bytes <= 0:
+      raise ValueError("The cache size must be positive, not %d" % max_bytes)
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._size = 0
+    self._entries = collections.OrderedDict()
+    self._keys = {}
+    self._lock = threading.Lock()
+
+  def __getstate__(self):
+    return {'max_bytes': self.max_bytes}
+
+  def __setstate__(self, state):
+    self.__init__(state['max_bytes'])
+
+  def __len__(self):
+    return len(self._entries)
+
+  def load(self, path, read, source=None):
+    """Returns the cached data of a file, reading it on a miss
+
+    Parameters
+    ----------
+    path : str
+        The path of the file.
+    read : callable
+        A function without arguments that reads the data of the file.
+    source : :obj:`str`, optional
+        The file whose modification time and size identify the version of
+        the data, if not ``path`` itself (e.g., the pack containing it).
+
+    Returns
+    -------
+    object
+        The data, read-only if it is cached.
+    """
+
+    path = os.path.realpath(path)
+    stat = os.stat(source or path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with self._lock:
+      data = self._entries.get(key)
+      if data is not None:
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return data
+      self.misses += 1
+
+    data = read()
+    if not isinstance(data, numpy.ndarray) or isinstance(data, numpy.memmap) \
+            or data.nbytes > self.max_bytes:
+      return data
+    data.flags.writeable = False
+
+    with self._lock:
+      # replaces older versions of the same file
+      old = self._keys.pop(path, None)
+      if old is not None and old in self._entries:
+        self._size -= self._entries.pop(old).nbytes
+      self._entries[key] = data
+      self._keys[path] = key
+      self._size += data.nbytes
+      while self._size > self.max_bytes:
+        (evicted, _, _), array = self._entries.popitem(last=False)
+        self._keys.pop(evicted, None)
+        self._size -= array.nbytes
+        self.evictions += 1
+    return data
+
+  def clear(self):
+    """Removes all arrays from the cache and resets the statistics"""
+
+    with self._lock:
+      self._entries.clear()
+      self._keys.clear()
+      self._size = 0
+      self.hits = self.misses = self.evictions = 0
+
+  @property
+  def hit_rate(self):
+    """The fraction of loads answered from the cache"""
+
+    total = self.hits + self.misses
+    return float(self.hits) / total if total else 0.
+
+  def info(self):
+    """Returns the cache statistics as a :py:data:`CacheInfo` tuple, with
+    sizes in bytes"""
+
+    return CacheInfo(self.hits, self.misses, self.evictions, self.max_bytes,
+                     self._size)
+
+
+def cache_directory():
+  """Returns the directory where query results are memoized
+
+  This is the value of the ``BOB_DB_CACHE_DIRECTORY`` environment variable if
+  it is set, or ``~/.cache/bob/db`` otherwise. If the environment variable is
+  set to an empty string, memoization is disabled and ``None`` is returned.
+  """
+
+  directory = os.environ.get('BOB_DB_CACHE_DIRECTORY')
+  if directory is None:
+    return os.path.join(os.path.expanduser('~'), '.cache', 'bob', 'db')
+  return directory or None
+
+
+def _normalize(value, nested=False):
+  """Normalizes query arguments, so equivalent ones produce the same key
+
+  Like in :py:func:`bob.db.base.utils.check_parameters_for_validity`, single
+  strings are equivalent to sequences with one element and empty sequences
+  are equivalent to ``None``.
+  """
+
+  if isinstance(value, str):
+    return value if nested else (value,)
+  if isinstance(value, (list, tuple)):
+    return tuple(_normalize(v, True) for v in value) or None
+  if isinstance(value, (set, frozenset)):
+    return tuple(sorted(_normalize(v, True) for v in value)) or None
+  if isinstance(value, dict):
+    return tuple(sorted((k, _normalize(v, True)) for k, v in value.items()))
+  return value
+
+
+def _digest(value):
+  return hashlib.sha1(repr(value).encode('utf-8')).hexdigest()
+
+
+class DiskCache(object):
+  """A persistent cache of query results on the file system.
+
+  Results are stored in one file per query, in a sub-directory per SQLite
+  file. Each file name starts with a digest of the size, modification time
+  and inode of the SQLite file, so that results are invalidated when the
+  metadata changes. Stale results of a SQLite file are removed when a new
+  result is stored for it. When the total size of the cache exceeds
+  ``max_bytes``, the least recently used results are removed.
+
+  Parameters
+  ----------
+  directory : str
+      The root directory of the cache.
+  max_bytes : int
+      The maximum total size of the cache, in bytes.
+  """
+
+  def __init__(self, directory, max_bytes):
+    self.directory = directory
+    self.max_bytes = max_bytes
+
+  def entry(self, sqlite_file, name, arguments):
+    """Returns the path of the cache entry for the given query
+
+    Parameters
+    ----------
+    sqlite_file : str
+        The SQLite file the query is run on.
+    name : str
+        The fully qualified name of the query method.
+    arguments : object
+        The normalized query arguments.
+
+    Raises
+    ------
+    OSError
+        If the SQLite file cannot be accessed.
+    """
+
+    sqlite_file = os.path.realpath(sqlite_file)
+    stat = os.stat(sqlite_file)
+    identity = _digest((stat.st_size, stat.st_mtime_ns, stat.st_ino))[:16]
+    return os.path.join(self.directory, _digest(sqlite_file)[:16],
+                        '%s-%s.pkl' % (identity, _digest((name, arguments))))
+
+  def get(self, entry):
+    """Returns the stored payload of an entry, or ``None`` if not found"""
+
+    try:
+      with open(entry, 'rb') as f:
+        payload = pickle.load(f)
+    except (OSError, IOError):
+      return None
+    except Exception:
+      logger.warning("Removing unreadable query cache entry '%s'", entry)
+      self._remove(entry)
+      return None
+    # marks the entry as recently used
+    self._touch(entry)
+    return payload
+
+  def put(self, entry, payload):
+    """Stores the payload of an entry, replacing stale and old entries"""
+
+    directory = os.path.dirname(entry)
+    if not os.path.isdir(directory):
+      os.makedirs(directory, exist_ok=True)
+    # other processes may be reading or writing the same entry
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        pickle.dump(payload, f, pickle.HIGHEST_PROTOCOL)
+      os.replace(temporary, entry)
+    except Exception:
+      self._remove(temporary)
+      raise
+
+    identity = os.path.basename(entry).split('-')[0]
+    for stale in glob.glob(os.path.join(directory, '*.pkl')):
+      if not os.path.basename(stale).startswith(identity):
+        self._remove(stale)
+    self.evict()
+
+  def evict(self):
+    """Removes the least recently used entries until the cache fits in
+    ``max_bytes``"""
+
+    entries = []
+    for entry in glob.glob(os.path.join(self.directory, '*', '*.pkl')):
+      try:
+        stat = os.stat(entry)
+      except OSError:
+        continue
+      entries.append((stat.st_mtime, stat.st_size, entry))
+    total = sum(e[1] for e in entries)
+    for _, size, entry in sorted(entries):
+      if total <= self.max_bytes:
+        break
+      self._remove(entry)
+      total -= size
+
+  @staticmethod
+  def _touch(path):
+    try:
+      os.utime(path)
+    except OSError:
+      pass
+
+  @staticmethod
+  def _remove(path):
+    try:
+      os.unlink(path)
+    except OSError:
+      pass
+
+
+def _encode_ids(ids):
+  """Stores integral ids as a compact array, and other ids as they are"""
+
+  if all(isinstance(i, (int, numpy.integer)) and not isinstance(i, bool)
+         for i in ids):
+    try:
+      return numpy.array(ids, dtype=numpy.int64)
+    except OverflowError:
+      pass
+  return list(ids)
+
+
+def _decode_ids(ids):
+  """Returns the ids stored by :py:func:`_encode_ids`, as a list"""
+
+  return ids.tolist() if isinstance(ids, numpy.ndarray) else list(ids)
+
+
+def _encode(database, result):
+  """Returns a compact payload for a query result, or ``None``"""
+
+  from .file import FileRecord
+  if isinstance(result, list) and result:
+    if all(isinstance(f, database.m_file_class) for f in result):
+      return ('files', _encode_ids([f.id for f in result]))
+    if all(isinstance(f, FileRecord) for f in result):
+      return ('records', _encode_ids([f.id for f in result]),
+              [f.path for f in result])
+  try:
+    pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+  except Exception:
+    return None
+  return ('value', result)
+
+
+def _decode(database, payload):
+  """Rebuilds the query result from its payload"""
+
+  from .file import FileRecord
+  kind = payload[0]
+  if kind == 'files':
+    return database.files(_decode_ids(payload[1]))
+  if kind == 'records':
+    return [FileRecord(i, p) for i, p in zip(_decode_ids(payload[1]),
+                                             payload[2])]
+  return payload[1]
+
+
+def memoize(method=None, directory=None, max_bytes=2**30):
+  """Persistently caches the results of a query method on the file system.
+
+  This decorator can be applied to ``objects()`` and similar methods of
+  :py:class:`bob.db.base.SQLiteBaseDatabase` derivatives, whose results only
+  depend on their arguments and on the SQLite file. For example:
+
+  .. code-block:: python
+
+     class Database(bob.db.base.SQLiteDatabase):
+
+       @bob.db.base.cache.memoize
+       def objects(self, groups=None, protocol=None, purposes=None):
+         ...
+
+  Results are stored in a :py:class:`DiskCache`, keyed by the identity of
+  the SQLite file and by the normalized arguments of the call. Lists of
+  ``File`` objects are stored as their ids (as arrays, for integral ids) and
+  re-created with :py:meth:`bob.db.base.SQLiteBaseDatabase.files`. Other
+  results are pickled, if possible.
+
+  Parameters
+  ----------
+  directory : :obj:`str`, optional
+      The directory of the cache. If not given, :py:func:`cache_directory` is
+      used at every call.
+  max_bytes : :obj:`int`, optional
+      The maximum size of the cache, in bytes.
+  """
+
+  if method is None:
+    return functools.partial(memoize, directory=directory,
+                             max_bytes=max_bytes)
+
+  signature = inspect.signature(method)
+  name = '%s.%s' % (method.__module__, method.__qualname__)
+
+  @functools.wraps(method)
+  def wrapper(self, *args, **kwargs):
+    root = directory or cache_directory()
+    if root is None:
+      return method(self, *args, **kwargs)
+    cache = DiskCache(root, max_bytes)
+
+    bound = signature.bind(self, *args, **kwargs)
+    bound.apply_defaults()
+    arguments = tuple((k, _normalize(v))
+                      for k, v in list(bound.arguments.items())[1:])
+    try:
+      entry = cache.entry(self.m_sqlite_file, name, arguments)
+    except OSError:
+      return method(self, *args, **kwargs)
+
+    payload = cache.get(entry)
+    if payload is not None:
+      try:
+        return _decode(self, payload)
+      except KeyError:
+        # the cached files are not in the database any longer
+        logger.warning("Ignoring outdated query cache entry '%s'", entry)
+
+    result = method(self, *args, **kwargs)
+    payload = _encode(self, result)
+    if payload is not None:
+      try:
+        cache.put(entry, payload)
+      except (OSError, IOError) as e:
+        logger.warning("Could not store query results in '%s': %s", root, e)
+    return result
+
+  return wrapper
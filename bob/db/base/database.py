@@ -4,10 +4,18 @@
 import os
 import warnings
 import logging
+import collections
+import functools
+import threading
 
-from . import utils
+import numpy
 
-from .file import File
+from . import utils, aio, pack
+from .storage import TieredStorage
+
+from .file import File, FileRecord
+from .table import FileTable
+from .cache import FileCache, LoadCache
 from .utils import check_parameters_for_validity, \
     check_parameter_for_validity, \
     convert_names_to_highlevel, \
@@ -27,28 +35,78 @@ class FileDatabase(object):
   Attributes
   ----------
   original_directory : str
-      The directory where the raw files are located.
+      The directory where the raw files are located, or a pack of these files
+      (see :py:mod:`bob.db.base.pack`). When a local copy is used, this is
+      the remote directory.
   original_extension : str
       The extension of raw data files, e.g. ``.png``.
+  check_existence : bool
+      Whether :py:meth:`original_file_name` checks that the file exists. It
+      can be set as a class attribute of derived classes, or given to the
+      constructor.
+  directory_index : :py:class:`bob.db.base.utils.DirectoryIndex`
+      The cached directory listings used to check that files exist.
+  load_cache : :py:class:`bob.db.base.cache.LoadCache`
+      The cache of loaded data used by the batch loaders (:py:meth:`load_many`
+      and :py:meth:`prefetch`), or ``None``. It can be given to the
+      constructor as a :py:class:`bob.db.base.cache.LoadCache` or as a size
+      in bytes.
+  storage : :py:class:`bob.db.base.storage.TieredStorage`
+      The local copy of the original directory the files are read through,
+      or ``None``. It can be given to the constructor as
+      ``original_directory``, or as a ``[local, remote]`` list of directories
+      together with the maximum size ``storage_max_bytes`` of the local copy.
   """
 
-  def __init__(self, original_directory, original_extension, **kwargs):
+  check_existence = True
+
+  def __init__(self, original_directory, original_extension,
+               check_existence=None, load_cache=None, storage_max_bytes=None,
+               **kwargs):
     super(FileDatabase, self).__init__(**kwargs)
+    self.storage = None
+    if isinstance(original_directory, (list, tuple)):
+      if len(original_directory) != 2 or storage_max_bytes is None:
+        raise ValueError("The storage tiers must be given as [local, remote] "
+                         "directories, with their storage_max_bytes")
+      original_directory = TieredStorage(
+          original_directory[0], original_directory[1], storage_max_bytes)
+    if isinstance(original_directory, TieredStorage):
+      self.storage = original_directory
+      original_directory = original_directory.remote
     self.original_directory = original_directory
     self.original_extension = original_extension
-
-  def original_file_names(self, files):
+    if check_existence is not None:
+      self.check_existence = check_existence
+    self.directory_index = utils.DirectoryIndex()
+    if load_cache is not None and not isinstance(load_cache, LoadCache):
+      load_cache = LoadCache(load_cache)
+    self.load_cache = load_cache
+
+  def original_file_names(self, files, check_existence=False):
     """Returns the full path of the original data of the given File objects.
 
     Parameters
     ----------
     files : list of :py:class:`bob.db.base.File`
         The list of file object to retrieve the original data file names for.
+    check_existence : :obj:`bool`, optional
+        If set, checks that all files exist, listing each of their
+        directories once through :py:attr:`directory_index`.
 
     Returns
     -------
     list of :obj:`str`
-        The paths extracted for the files, in the same order.
+        The paths extracted for the files, in the same order. When
+        :py:attr:`storage` is set, these are the paths of the local copies,
+        which are fetched in parallel. All of them are kept until this
+        returns, even if they exceed the size of the local storage, but they
+        may be removed by later fetches.
+
+    Raises
+    ------
+    ValueError
+        if ``check_existence`` is set and some files are not found.
     """
     if self.original_directory is None:
       logger.warning(
@@ -56,8 +114,23 @@ class FileDatabase(object):
     if self.original_extension is None:
       logger.warning(
           'self.original_extension was not provided (must not be None)!')
-    return file_names(
+    if self.storage is not None:
+      return self._fetch_many(files, check_existence)
+    paths = file_names(
         files, self.original_directory, self.original_extension)
+    if check_existence:
+      exists = self._in_pack(files)
+      if exists is None:
+        exists = self.directory_index.exists_many(paths)
+      missing = [p for p, e in zip(paths, exists) if not e]
+      if missing:
+        raise ValueError("%d files (out of %d) were not found, e.g. '%s'. "
+                         "Please check the original directory '%s' and "
+                         "extension '%s'?" % (
+                             len(missing), len(paths), missing[0],
+                             self.original_directory,
+                             self.original_extension))
+    return paths
 
   def original_file_name(self, file):
     """This function returns the original file name for the given File
@@ -73,7 +146,8 @@ class FileDatabase(object):
     -------
     str
         The original file name for the given :py:class:`bob.db.base.File`
-        object.
+        object. When :py:attr:`storage` is set, this is the path of the local
+        copy, which is fetched if required.
 
     Raises
     ------
@@ -85,10 +159,29 @@ class FileDatabase(object):
       logger.warning(
           "The original_directory and/or the original_extension were not"
           " specified in the constructor.")
+    if self.storage is not None:
+      relative = file.make_path('', self.original_extension)
+      try:
+        return self.storage.fetch(relative)
+      except (IOError, OSError):
+        if not self.check_existence:
+          return self.storage.local_path(relative)
+        raise ValueError("The file '%s' was not found. Please check the "
+                         "original directory '%s' and extension '%s'?" % (
+                             self.storage.remote_path(relative),
+                             self.original_directory,
+                             self.original_extension))
     # extract file name
     file_name = file.make_path(
         self.original_directory, self.original_extension)
-    if not self.check_existence or os.path.exists(file_name):
+    if not self.check_existence:
+      return file_name
+    in_pack = self._in_pack([file])
+    if in_pack is None:
+      exists = self.directory_index.exists(file_name)
+    else:
+      exists = in_pack[0]
+    if exists:
       return file_name
     raise ValueError("The file '%s' was not found. Please check the "
                      "original directory '%s' and extension '%s'?" % (
@@ -96,6 +189,332 @@ class FileDatabase(object):
                          self.original_directory,
                          self.original_extension))
 
+  def _fetch_many(self, files, check_existence):
+    """Fetches the local copies of files, returning their paths
+
+    The copies are pinned until all of them are fetched, so that none of the
+    returned paths was removed to make room for the others.
+    """
+
+    relative = file_names(files, None, self.original_extension, lazy=True)
+    pinned = utils.parallel_map(self.storage.acquire, relative,
+                                on_error='skip')
+    try:
+      missing = [r for r, p in zip(relative, pinned) if p is None]
+      if check_existence and missing:
+        raise ValueError("%d files (out of %d) were not found, e.g. '%s'. "
+                         "Please check the original directory '%s' and "
+                         "extension '%s'?" % (
+                             len(missing), len(relative),
+                             self.storage.remote_path(missing[0]),
+                             self.original_directory,
+                             self.original_extension))
+      return file_names(files, self.storage.local, self.original_extension)
+    finally:
+      for path in pinned:
+        if path is not None:
+          self.storage.release(path)
+
+  def _in_pack(self, files):
+    """Tells which files are in the pack used as original directory, or
+    returns ``None`` if the original directory is not a pack"""
+
+    archive = pack.open_pack(self.original_directory)
+    if archive is None:
+      return None
+    return [f.make_path('', self.original_extension).replace(os.sep, '/')
+            in archive for f in files]
+
+  def _loader(self, function, directory, extension, mmap=False,
+              processes=False):
+    """Binds the arguments of the batch loaders to their worker function"""
+
+    if directory is None:
+      directory = self.storage or self.original_directory
+    if extension is None:
+      extension = self.original_extension
+    # only given to File.load, see _call_load
+    options = {}
+    if mmap:
+      options['mmap'] = True
+    if self.load_cache is not None and not processes:
+      options['cache'] = self.load_cache
+    return functools.partial(function, directory=directory,
+                             extension=extension, options=options)
+
+  def _locality(self, files, load, order, workers, read_ahead):
+    """Returns the positions of the files in the order to read them, and a
+    schedule issuing read-ahead hints for them if requested"""
+
+    paths = utils.make_paths(files, _remote(load.keywords['directory']),
+                             load.keywords['extension'])
+    if order is None:
+      positions = list(range(len(paths)))
+    else:
+      positions = utils.locality_order(paths, order, workers)
+    schedule = None
+    if read_ahead:
+      schedule = _ReadAhead([paths[i] for i in positions])
+    return positions, schedule
+
+  def load_many(self, files, directory=None, extension=None, workers=None,
+                on_error='raise', retries=0, processes=False, mmap=False,
+                order=None, read_ahead=False):
+    """Loads the data of many files in parallel.
+
+    Each file is loaded with its own :py:meth:`bob.db.base.File.load` method,
+    so derived classes that override it are supported. The loads run in a
+    pool of threads, or of processes if the loading is CPU-bound.
+
+    Parameters
+    ----------
+    files : list of :py:class:`bob.db.base.File`
+        The files to load.
+    directory : :obj:`str`, optional
+        The directory of the files, :py:attr:`original_directory` by default,
+        read through :py:attr:`storage` if set.
+    extension : :obj:`str`, optional
+        The extension of the files, :py:attr:`original_extension` by default.
+    workers : :obj:`int`, optional
+        The number of files loaded concurrently.
+    on_error : :obj:`str`, optional
+        What to do if a file cannot be loaded: ``raise`` the error, or
+        ``skip`` the file, logging the error and returning ``None`` for it.
+    retries : :obj:`int`, optional
+        The number of times the loading of a file is retried before
+        ``on_error`` applies, e.g., to overcome transient network errors.
+    processes : :obj:`bool`, optional
+        If set, files are loaded in separate processes. The files must then be
+        picklable, and :py:attr:`load_cache` is not used.
+    mmap : :obj:`bool`, optional
+        If set, the data is memory-mapped when possible, see
+        :py:meth:`bob.db.base.File.load`. Files whose class overrides
+        ``load`` are read normally. This cannot be combined with
+        ``processes``.
+    order : :obj:`str`, optional
+        If given, files are read in the order of their physical locality,
+        either ``directory`` or ``inode`` (see
+        :py:func:`bob.db.base.utils.locality_order`). This speeds up reading
+        from spinning disks and network storage with a cold cache.
+    read_ahead : :obj:`bool`, optional
+        If set, the operating system is told to read ahead the files about to
+        be loaded (see :py:func:`bob.db.base.utils.advise_willneed`). This
+        opens each file once more, so it only pays off on local disks.
+
+    Returns
+    -------
+    list
+        The loaded data, in the same order as ``files``.
+    """
+
+    if mmap and processes:
+      raise ValueError("Memory-mapped arrays cannot be loaded in separate "
+                       "processes")
+    load = self._loader(_load, directory, extension, mmap, processes)
+    if order is None and not read_ahead:
+      return utils.parallel_map(load, files, workers=workers,
+                                on_error=on_error, retries=retries,
+                                processes=processes)
+    files = list(files)
+    positions, schedule = self._locality(files, load, order, workers,
+                                         read_ahead)
+    data = utils.parallel_map(load, [files[i] for i in positions],
+                              workers=workers, on_error=on_error,
+                              retries=retries, processes=processes,
+                              schedule=schedule)
+    # delivers the data in the order of the caller
+    result = [None] * len(files)
+    for i, d in zip(positions, data):
+      result[i] = d
+    return result
+
+  def prefetch(self, files, directory=None, extension=None, depth=8,
+               workers=None, on_error='raise', retries=0, mmap=False,
+               order=None, read_ahead=False):
+    """Iterates over files and their data, loading the next ones ahead.
+
+    While the caller processes a file, up to ``depth`` of the following files
+    are loaded in the background by ``workers`` threads. When the caller is
+    slower than the loading, no more files are read until it catches up. If
+    the iteration is stopped early, e.g., by ``break`` or an exception, the
+    pending loads are cancelled and the threads are stopped.
+
+    Each file is loaded with its own :py:meth:`bob.db.base.File.load` method,
+    so derived classes that override it are supported.
+
+    Parameters
+    ----------
+    files : iterable of :py:class:`bob.db.base.File`
+        The files to load, possibly a generator.
+    directory : :obj:`str`, optional
+        The directory of the files, :py:attr:`original_directory` by default,
+        read through :py:attr:`storage` if set.
+    extension : :obj:`str`, optional
+        The extension of the files, :py:attr:`original_extension` by default.
+    depth : :obj:`int`, optional
+        The maximum number of files loaded ahead of the caller.
+    workers : :obj:`int`, optional
+        The number of files loaded concurrently, at most ``depth``.
+    on_error : :obj:`str`, optional
+        What to do if a file cannot be loaded: ``raise`` the error, or
+        ``skip`` the file, logging the error and leaving it out of the
+        iteration.
+    retries : :obj:`int`, optional
+        The number of times the loading of a file is retried before
+        ``on_error`` applies.
+    mmap : :obj:`bool`, optional
+        If set, the data is memory-mapped when possible, see
+        :py:meth:`bob.db.base.File.load`.
+    order : :obj:`str`, optional
+        If given, ``directory`` or ``inode``: the files are read by physical
+        locality within each half of the read-ahead window, see
+        :py:meth:`load_many`. They are still yielded in their original order.
+    read_ahead : :obj:`bool`, optional
+        If set, the operating system is told to read ahead the files about to
+        be loaded, see :py:meth:`load_many`.
+
+    Yields
+    ------
+    tuple
+        The ``(file, data)`` pairs, in the same order as ``files``.
+    """
+
+    if depth <= 0:
+      raise ValueError("The prefetch depth must be positive, not %d" % depth)
+    load = self._loader(_load_pair, directory, extension, mmap)
+    workers = min(workers or depth, depth)
+    schedule = None
+    if order is not None or read_ahead:
+      schedule = _Locality(order, load.keywords['directory'],
+                           load.keywords['extension'], read_ahead)
+    pairs = utils.parallel_imap(load, files, workers=workers, depth=depth,
+                                on_error=on_error, retries=retries,
+                                schedule=schedule)
+    try:
+      for pair in pairs:
+        if pair is not None:
+          yield pair
+    finally:
+      pairs.close()
+
+  def load_batch(self, files, out=None, directory=None, extension=None,
+                 workers=None, mmap=False, order=None, read_ahead=False):
+    """Loads samples of the same shape into one contiguous array.
+
+    Sample ``i`` is stored in ``out[i]``. Unless ``out`` is given, a new
+    array is allocated. To build successive batches without allocating new
+    memory, give the same :py:class:`bob.db.base.utils.BatchBuffer` as
+    ``out`` to each call; the returned array is then overwritten by the next
+    call.
+
+    Files are loaded in parallel, each directly into its row of the array
+    when :py:meth:`bob.db.base.File.load` supports it (see its ``out``
+    argument). Otherwise, the loaded data is copied into the array.
+
+    Parameters
+    ----------
+    files : list of :py:class:`bob.db.base.File`
+        The files to load.
+    out : :py:class:`numpy.ndarray` or :py:class:`bob.db.base.utils.BatchBuffer`, optional
+        The array to fill, with one row per file, or the buffer to reuse.
+    directory : :obj:`str`, optional
+        The directory of the files, :py:attr:`original_directory` by default,
+        read through :py:attr:`storage` if set.
+    extension : :obj:`str`, optional
+        The extension of the files, :py:attr:`original_extension` by default.
+    workers : :obj:`int`, optional
+        The number of files loaded concurrently.
+    mmap : :obj:`bool`, optional
+        If set, the data is memory-mapped when possible before being copied,
+        which avoids an intermediate array.
+    order : :obj:`str`, optional
+        If given, ``directory`` or ``inode``: the files are read by physical
+        locality, see :py:meth:`load_many`.
+    read_ahead : :obj:`bool`, optional
+        If set, the operating system is told to read ahead the files about to
+        be loaded, see :py:meth:`load_many`.
+
+    Returns
+    -------
+    :py:class:`numpy.ndarray`
+        The array of all samples, ``out`` if it is an array.
+
+    Raises
+    ------
+    ValueError
+        If the samples do not all have the same shape.
+    """
+
+    files = list(files)
+    load = self._loader(_load_into, directory, extension, mmap)
+    if out is None or isinstance(out, utils.BatchBuffer):
+      if not files:
+        raise ValueError("Cannot allocate a batch for an empty list of files")
+      # the first sample gives the shape and type of the batch
+      first = numpy.asarray(load((files[0], None)))
+      if out is None:
+        out = numpy.empty((len(files),) + first.shape, dtype=first.dtype)
+      else:
+        out = out.get(len(files), first.shape, first.dtype)
+      out[0] = first
+      rows = [(f, out[i]) for i, f in enumerate(files) if i]
+    else:
+      if len(out) != len(files):
+        raise ValueError("The output array has %d rows for %d files" %
+                         (len(out), len(files)))
+      rows = [(f, out[i]) for i, f in enumerate(files)]
+    schedule = None
+    if order is not None or read_ahead:
+      positions, schedule = self._locality([f for f, _ in rows], load, order,
+                                           workers, read_ahead)
+      rows = [rows[i] for i in positions]
+    utils.parallel_map(load, rows, workers=workers, schedule=schedule)
+    return out
+
+  def save_many(self, files, data, directory, extension='.hdf5', workers=None,
+                on_error='raise'):
+    """Saves the data of many files in parallel and atomically.
+
+    Each blob is written with :py:func:`bob.io.base.save` to a temporary file
+    next to its destination, which is then renamed to the destination. An
+    interrupted job therefore never leaves partially written files behind,
+    and can simply be restarted. Directories are created as needed, checking
+    each of them only once.
+
+    Parameters
+    ----------
+    files : list of :py:class:`bob.db.base.File`
+        The files to save, whose :py:meth:`bob.db.base.File.make_path` method
+        gives the destination paths.
+    data : list
+        The data blobs to save, in the same order as ``files``.
+    directory : str
+        The directory where the files are saved.
+    extension : :obj:`str`, optional
+        The extension of the files, which selects the file format.
+    workers : :obj:`int`, optional
+        The number of files written concurrently.
+    on_error : :obj:`str`, optional
+        What to do if a file cannot be saved: ``raise`` the error, or
+        ``skip`` the file, logging the error and returning ``None`` as its
+        path.
+
+    Returns
+    -------
+    list of :obj:`str`
+        The paths of the saved files, in the same order as ``files``.
+    """
+
+    files = list(files)
+    data = list(data)
+    if len(files) != len(data):
+      raise ValueError("The number of files (%d) and data blobs (%d) differ"
+                       % (len(files), len(data)))
+    paths = [f.make_path(directory or '', extension or '') for f in files]
+    save = functools.partial(_save, directories=_Directories())
+    return utils.parallel_map(save, [_Blob(p, d) for p, d in zip(paths, data)],
+                              workers=workers, on_error=on_error)
+
   # Deprecated Methods below
 
   def check_parameters_for_validity(self, parameters, parameter_description,
@@ -146,6 +565,154 @@ class FileDatabase(object):
     return sort_files(files)
 
 
+class _ReadAhead(object):
+  """Issues read-ahead hints for consecutive groups of files scheduled by
+  :py:func:`bob.db.base.utils.parallel_imap`"""
+
+  def __init__(self, paths):
+    self._paths = paths
+    self._next = 0
+
+  def __call__(self, group):
+    start, self._next = self._next, self._next + len(group)
+    utils.advise_willneed(self._paths[start:self._next])
+    return range(len(group))
+
+
+class _Locality(object):
+  """Orders groups of files by locality and issues read-ahead hints, if
+  requested"""
+
+  def __init__(self, order, directory, extension, read_ahead):
+    self.order = order
+    self.directory = _remote(directory)
+    self.extension = extension
+    self.read_ahead = read_ahead
+
+  def __call__(self, group):
+    paths = utils.make_paths(group, self.directory, self.extension)
+    if self.order is None:
+      positions = list(range(len(paths)))
+    else:
+      positions = utils.locality_order(paths, self.order)
+    if self.read_ahead:
+      utils.advise_willneed([paths[i] for i in positions])
+    return positions
+
+
+def _remote(directory):
+  """Returns the directory files are read from when they are not local"""
+
+  if isinstance(directory, TieredStorage):
+    return directory.remote
+  return directory
+
+
+def _call_load(f, directory, extension, options, out=None):
+  """Loads a file with the options of the batch loaders, which are only
+  given to :py:meth:`bob.db.base.File.load` itself"""
+
+  if isinstance(directory, TieredStorage):
+    # the local copy is kept until it is read
+    return directory.read(
+        f.make_path('', extension or ''),
+        functools.partial(_call_load, f, extension=extension,
+                          options=options, out=out))
+  if getattr(type(f), 'load', None) is File.load:
+    if out is not None:
+      return f.load(directory, extension, out=out, **options)
+    return f.load(directory, extension, **options)
+  # overridden load methods may not support the optional arguments, so the
+  # file is read normally, through the cache if it is a file
+  cache = options.get('cache')
+  path = f.make_path(directory, extension)
+  if cache is not None and os.path.isfile(path):
+    data = cache.load(path, functools.partial(f.load, directory, extension))
+  else:
+    data = f.load(directory, extension)
+  if out is None:
+    return data
+  if numpy.shape(data) != out.shape:
+    raise ValueError("The shape %s of '%s' does not match the shape %s of "
+                     "the batch" % (numpy.shape(data), f.path, out.shape))
+  out[...] = data
+  return out
+
+
+def _load(f, directory, extension, options):
+  """Loads a file, in the workers of the batch loaders"""
+
+  return _call_load(f, directory, extension, options)
+
+
+def _load_into(row, directory, extension, options):
+  """Loads a file into a row of a batch, or returns its data if no row is
+  given"""
+
+  f, out = row
+  return _call_load(f, directory, extension, options, out)
+
+
+def _load_pair(f, directory, extension, options):
+  """Loads a file, returning it together with its data"""
+
+  return f, _call_load(f, directory, extension, options)
+
+
+class _Directories(object):
+  """Creates directories, remembering those that already exist"""
+
+  def __init__(self):
+    self._existing = set()
+    self._lock = threading.Lock()
+
+  def create(self, directory):
+    if directory in self._existing:
+      return
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    with self._lock:
+      self._existing.add(directory)
+
+
+class _Blob(object):
+  """Data to be saved at a path, represented by its path in logs"""
+
+  __slots__ = ('path', 'data')
+
+  def __init__(self, path, data):
+    self.path = path
+    self.data = data
+
+  def __repr__(self):
+    return repr(self.path)
+
+
+def _save(blob, directories):
+  """Saves data atomically, in the workers of the batch writers"""
+
+  import uuid
+  import bob.io.base
+
+  path, data = blob.path, blob.data
+  directory, name = os.path.split(path)
+  directories.create(directory)
+  # the temporary file keeps the extension, which selects the format; it is
+  # created with the permissions of a new file, i.e., as allowed by the umask
+  extension = os.path.splitext(name)[1]
+  temporary = os.path.join(directory, '.%s.%s%s' % (
+      name, uuid.uuid4().hex, extension))
+  os.close(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+  try:
+    bob.io.base.save(data, temporary)
+    os.replace(temporary, path)
+  except Exception:
+    if os.path.exists(temporary):
+      os.unlink(temporary)
+    raise
+  return path
+
+
 class Database(FileDatabase):
   """This class is deprecated. New databases should use the
   :py:class:`bob.db.base.FileDatabase` class if required"""
@@ -163,7 +730,9 @@ class SQLiteBaseDatabase(object):
   """This class can be used for handling SQL databases.
 
   It opens an SQL database in a read-only mode and keeps it opened during the
-  whole session.
+  whole session. The connection is only established on the first
+  :py:meth:`query`, so that creating, pickling and unpickling objects of this
+  class is cheap.
 
 
   Parameters
@@ -177,23 +746,76 @@ class SQLiteBaseDatabase(object):
       :py:class:`bob.db.base.File`. This is required to be able to
       :py:meth:`query` the databases later on.
 
+  cache_size : :obj:`int`, optional
+      If set, keeps up to this number of ``File`` objects in a
+      :py:class:`bob.db.base.cache.FileCache`, which is consulted by
+      :py:meth:`files`, :py:meth:`paths` and :py:meth:`reverse` before
+      querying the database. The least recently used objects are evicted
+      first.
+
+  in_memory : :obj:`bool`, optional
+      If set, the SQLite file is copied into memory when the session is
+      opened and all queries are served from that copy. This is useful when
+      the file sits on a slow (e.g. network) filesystem.
+
+  thread_safe : :obj:`bool`, optional
+      If set, :py:attr:`m_session` is a
+      :py:class:`sqlalchemy.orm.scoping.scoped_session`, which keeps one
+      session per thread, and connections are pooled so that concurrent
+      queries from different threads do not share a connection. This is
+      required if the database object is queried from several threads.
+
+  poolclass : :obj:`type`, optional
+      The :py:class:`sqlalchemy.pool.Pool` subclass managing connections. If
+      not set, :py:class:`sqlalchemy.pool.QueuePool` is used in
+      ``thread_safe`` mode, a single shared connection for ``in_memory``
+      databases and no pooling otherwise.
+
+  pool_size : :obj:`int`, optional
+      The number of connections kept open by pools that support it.
+
+  connection_profile : :obj:`str`, optional
+      The name of a connection profile of
+      :py:class:`bob.db.base.utils.SQLiteConnector`, such as
+      ``read-optimized``, which memory-maps the SQLite file and skips locking.
+
   Attributes
   ----------
   m_file_class : :py:class:`bob.db.base.File`
       The `file_class` parameter is kept in this attribute.
   m_session : object
-      The SQL session object.
+      The SQL session object, which is opened on first access.
   m_sqlite_file : str
       The `sqlite_file` parameter is kept in this attribute.
+  m_cache : :py:class:`bob.db.base.cache.FileCache` or ``None``
+      The cache of ``File`` objects, if ``cache_size`` was given.
+  m_in_memory : bool
+      The `in_memory` parameter is kept in this attribute.
+  m_thread_safe : bool
+      The `thread_safe` parameter is kept in this attribute.
+  m_connection_profile : str
+      The `connection_profile` parameter is kept in this attribute.
+  lookup_chunk_size : int
+      The maximum number of keys bound in a single ``IN (...)`` clause by
+      :py:meth:`files`, :py:meth:`paths` and :py:meth:`reverse`. The default
+      matches the smallest compiled-in limit of SQLite on bound variables.
   """
 
-  def __init__(self, sqlite_file, file_class, **kwargs):
+  lookup_chunk_size = 999
+
+  def __init__(self, sqlite_file, file_class, cache_size=None,
+               in_memory=False, thread_safe=False, poolclass=None,
+               pool_size=None, connection_profile=None, **kwargs):
     super(SQLiteBaseDatabase, self).__init__(**kwargs)
     self.m_sqlite_file = sqlite_file
-    if not os.path.exists(sqlite_file):
-      self.m_session = None
-    else:
-      self.m_session = utils.session_try_readonly('sqlite', sqlite_file)
+    self.m_cache = FileCache(cache_size) if cache_size else None
+    self.m_in_memory = in_memory
+    self.m_thread_safe = thread_safe
+    self.m_poolclass = poolclass
+    self.m_pool_size = pool_size
+    self.m_connection_profile = connection_profile
+    self._m_session = None
+    self._m_lock = threading.RLock()
 
     # assert the given file class is derived from the File class
     assert issubclass(file_class, File)
@@ -201,35 +823,70 @@ class SQLiteBaseDatabase(object):
 
   def __getstate__(self):
     state = self.__dict__.copy()
-    state["m_session"] = None
+    state["_m_session"] = None
+    del state["_m_lock"]
     return state
 
   def __setstate__(self, state):
+    # objects pickled before sessions were opened lazily
+    state.pop("m_session", None)
+    state["_m_session"] = None
+    state["_m_lock"] = threading.RLock()
     self.__dict__.update(state)
-    if os.path.exists(self.m_sqlite_file):
-      self.m_session = utils.session_try_readonly('sqlite', self.m_sqlite_file)
+
+  def _open_session(self):
+    """Opens a read-only session to the SQLite file"""
+
+    poolclass = self.m_poolclass
+    if poolclass is None and self.m_thread_safe and not self.m_in_memory:
+      from sqlalchemy.pool import QueuePool
+      poolclass = QueuePool
+    return utils.session_try_readonly('sqlite', self.m_sqlite_file,
+                                      in_memory=self.m_in_memory,
+                                      scoped=self.m_thread_safe,
+                                      poolclass=poolclass,
+                                      pool_size=self.m_pool_size,
+                                      profile=self.m_connection_profile)
+
+  @property
+  def m_session(self):
+    if self._m_session is None and os.path.exists(self.m_sqlite_file):
+      with self._m_lock:
+        if self._m_session is None:
+          self._m_session = self._open_session()
+    return self._m_session
+
+  @m_session.setter
+  def m_session(self, session):
+    self._m_session = session
 
   def __del__(self):
     """Closes the connection to the database."""
 
-    if self.is_valid():
+    if getattr(self, '_m_session', None) is not None:
       # do some magic to close the connection to the database file
       try:
         # Since the dispose function re-creates a pool
         # which might fail in some conditions, e.g., when this
         # destructor is called during the exit of the python
         # interpreter
-        self.m_session.close()
-        self.m_session.bind.dispose()
+        self._m_session.close()
+        self._m_session.bind.dispose()
       except (TypeError, AttributeError, KeyError):
         # ... I can just ignore the according exception...
         pass
 
   def is_valid(self):
-    """Returns if a valid session has been opened for reading the database.
+    """Returns if the database can be read, i.e., if a session is opened or
+    the SQLite file exists. This does not connect to the database.
     """
 
-    return self.m_session is not None
+    return self._m_session is not None or os.path.exists(self.m_sqlite_file)
+
+  def is_open(self):
+    """Returns if a session to the database has already been opened."""
+
+    return self._m_session is not None
 
   def assert_validity(self):
     """Raise a RuntimeError if the database back-end is not available."""
@@ -245,6 +902,117 @@ class SQLiteBaseDatabase(object):
     self.assert_validity()
     return self.m_session.query(*args)
 
+  def cache_info(self):
+    """Returns the statistics of the ``File`` object cache
+
+    Returns
+    -------
+    :py:data:`bob.db.base.cache.CacheInfo` or ``None``
+        The hits, misses, evictions, maximum and current size of the cache, or
+        ``None`` if no ``cache_size`` was given to the constructor.
+    """
+
+    return self.m_cache.info() if self.m_cache is not None else None
+
+  def clear_cache(self):
+    """Empties the ``File`` object cache, if any"""
+
+    if self.m_cache is not None:
+      self.m_cache.clear()
+
+  def _lookup(self, column, keys, preserve_order=True, fetch=None):
+    """Bulk-fetches ``File`` objects whose ``column`` matches any of ``keys``
+
+    The lookup is split in chunks of at most :py:attr:`lookup_chunk_size`
+    unique keys, so that each ``IN (...)`` clause stays below the SQLite limit
+    on the number of bound variables. Each key is queried only once and rows
+    are matched back to the keys with a single dictionary, so the cost of the
+    lookup grows linearly with the number of keys.
+
+    Duplicate keys yield the same ``File`` object at every position they
+    appear in, if ``preserve_order`` is set. Otherwise, each matched object is
+    returned once, in the order of the first occurrence of its key. Missing
+    keys raise a :py:exc:`KeyError` if ``preserve_order`` is set and are
+    silently skipped otherwise.
+
+    If a cache is configured, only the keys missing from it are queried, and
+    the fetched objects are added to it.
+
+    Instead of ``File`` objects, any other value can be looked up by passing
+    a ``fetch`` function, which receives a chunk of keys and returns an
+    iterable of ``(key, value)`` pairs for the keys found. The cache is not
+    used in this case.
+    """
+
+    keys = list(keys)
+    unique = list(collections.OrderedDict.fromkeys(keys))
+    found = {}
+    pending = unique
+    if fetch is None:
+      fetch = functools.partial(self._fetch_files, column)
+      if self.m_cache is not None:
+        for k in unique:
+          f = self.m_cache.get(k, column.key)
+          if f is not None:
+            found[k] = f
+        pending = [k for k in unique if k not in found]
+
+    chunk_size = self.lookup_chunk_size
+    for start in range(0, len(pending), chunk_size):
+      found.update(fetch(pending[start:start + chunk_size]))
+
+    if not preserve_order:
+      return [found[k] for k in unique if k in found]
+
+    if len(found) != len(unique):
+      missing = [k for k in unique if k not in found]
+      raise KeyError(
+          "%d of the requested %s values could not be found in the database "
+          "'%s', e.g.: %s" % (len(missing), column.key, self.m_sqlite_file,
+                              ', '.join(repr(k) for k in missing[:5])))
+
+    return [found[k] for k in keys]
+
+  def _fetch_files(self, column, keys):
+    """Yields ``(key, File)`` pairs for the objects matching the keys"""
+
+    for f in self.query(self.m_file_class).filter(column.in_(keys)):
+      if self.m_cache is not None:
+        self.m_cache.put(f)
+      yield getattr(f, column.key), f
+
+  def _fetch_rows(self, column, keys):
+    """Yields ``(key, (id, path))`` pairs for the rows matching the keys"""
+
+    cls = self.m_file_class
+    for row in self._select_rows(self.query(cls).filter(column.in_(keys))):
+      yield getattr(row, column.key), (row.id, row.path)
+
+  def _select_rows(self, query):
+    """Executes a query for its ``id`` and ``path`` columns only
+
+    The statement is executed through SQLAlchemy Core, so that the returned
+    rows are plain tuples that do not go through the ORM.
+    """
+
+    cls = self.m_file_class
+    statement = query.with_entities(cls.id, cls.path).statement
+    return self.m_session.execute(statement)
+
+  def _rows(self, ids=None, paths=None, query=None, preserve_order=True):
+    """Returns ``(id, path)`` rows by ids, paths, query or for all files"""
+
+    cls = self.m_file_class
+    if ids is not None:
+      return self._lookup(cls.id, ids, preserve_order,
+                          functools.partial(self._fetch_rows, cls.id))
+    if paths is not None:
+      return self._lookup(cls.path, paths, preserve_order,
+                          functools.partial(self._fetch_rows, cls.path))
+    if query is None:
+      query = self.query(cls).order_by(cls.id)
+    return self._select_rows(query)
+
   def files(self, ids, preserve_order=True):
     """Returns a list of ``File`` objects with the given file ids
 
@@ -255,27 +1023,26 @@ class SQLiteBaseDatabase(object):
         should be a python iterable (such as a tuple or list).
 
     preserve_order : bool
-        If True (the default) the order of elements is preserved, but the
-        execution time increases.
+        If True (the default) the returned list matches ``ids`` one-to-one,
+        including duplicates. Otherwise, every matching object is returned
+        only once and unknown ids are ignored.
 
     Returns
     -------
     list
         a list (that may be empty) of ``File`` objects.
 
+    Raises
+    ------
+    KeyError
+        If ``preserve_order`` is set and some of the ids are not found.
+
     """
 
-    file_objects = self.query(self.m_file_class).filter(
-        self.m_file_class.id.in_(ids))
-    if not preserve_order:
-      return list(file_objects)
-    else:
-      path_dict = {}
-      for f in file_objects:
-        path_dict[f.id] = f
-      return [path_dict[id] for id in ids]
+    return self._lookup(self.m_file_class.id, ids, preserve_order)
 
-  def paths(self, ids, prefix=None, suffix=None, preserve_order=True):
+  def paths(self, ids, prefix=None, suffix=None, preserve_order=True,
+            lazy=False):
     """Returns a full file paths considering particular file ids
 
 
@@ -290,19 +1057,29 @@ class SQLiteBaseDatabase(object):
         The extension determines the suffix that will be appended to the
         filename stem.
     preserve_order : bool
-        If True (the default) the order of elements is preserved, but the
-        execution time increases.
+        If True (the default) the order of elements is preserved. See
+        :py:meth:`files` for the handling of duplicate and unknown ids.
+    lazy : :obj:`bool`, optional
+        If set, the paths may be returned as a lazy
+        :py:class:`bob.db.base.utils.PathList`, which only builds each path
+        when it is accessed.
 
     Returns
     -------
     list
-        A list (that may be empty) of the fully constructed paths given
-        the file ids.
+        A list (that may be empty) of the fully constructed paths given the
+        file ids.
 
     """
 
-    file_objects = self.files(ids, preserve_order)
-    return [f.make_path(prefix, suffix) for f in file_objects]
+    if self.m_cache is not None or \
+            self.m_file_class.make_path is not File.make_path:
+      file_objects = self.files(ids, preserve_order)
+      return file_names(file_objects, prefix, suffix, lazy)
+    # builds the paths from the path column, without creating File objects
+    rows = self._rows(ids=ids, preserve_order=preserve_order)
+    paths = utils.PathList([path for _, path in rows], prefix, suffix)
+    return paths if lazy else paths.tolist()
 
   def reverse(self, paths, preserve_order=True):
     """Reverses the lookup from certain paths, returns a list of
@@ -315,23 +1092,105 @@ class SQLiteBaseDatabase(object):
         python iterable (such as a tuple or list)
 
     preserve_order : :obj:`bool`, optional
-        If True (the default) the order of elements is preserved, but the
-        execution time increases.
+        If True (the default) the order of elements is preserved. See
+        :py:meth:`files` for the handling of duplicate and unknown paths.
 
     Returns
     -------
     list
         A list (that may be empty).
 
+    Raises
+    ------
+    KeyError
+        If ``preserve_order`` is set and some of the paths are not found.
+
     """
 
-    file_objects = self.query(self.m_file_class).filter(
-        self.m_file_class.path.in_(paths))
-    if not preserve_order:
-      return file_objects
-    else:
-      path_dict = {f.path: f for f in file_objects}
-      return [path_dict[path] for path in paths]
+    return self._lookup(self.m_file_class.path, paths, preserve_order)
+
+  def _serialized(self, function, *args, **kwargs):
+    """Calls the function, serializing calls unless in ``thread_safe`` mode
+    """
+
+    if self.m_thread_safe:
+      return function(*args, **kwargs)
+    with self._m_lock:
+      return function(*args, **kwargs)
+
+  async def afiles(self, ids, preserve_order=True):
+    """Awaitable version of :py:meth:`files`
+
+    The query is run in the SQL executor of :py:mod:`bob.db.base.aio`. Unless
+    this database is ``thread_safe``, concurrent queries are serialized.
+    """
+
+    return await aio.run_sql(self._serialized, self.files, ids,
+                             preserve_order)
+
+  async def apaths(self, ids, prefix=None, suffix=None, preserve_order=True,
+                   lazy=False):
+    """Awaitable version of :py:meth:`paths`, see :py:meth:`afiles`"""
+
+    return await aio.run_sql(self._serialized, self.paths, ids, prefix,
+                             suffix, preserve_order, lazy)
+
+  async def areverse(self, paths, preserve_order=True):
+    """Awaitable version of :py:meth:`reverse`, see :py:meth:`afiles`"""
+
+    return await aio.run_sql(self._serialized, self.reverse, paths,
+                             preserve_order)
+
+  def file_table(self, ids=None, query=None, preserve_order=True,
+                 paths=None):
+    """Returns the ids and paths of files as a compact
+    :py:class:`bob.db.base.FileTable`
+
+    Only the ``id`` and ``path`` columns are read from the database, so no
+    ``File`` object is created.
+
+    Parameters
+    ----------
+    ids : :obj:`list` or :obj:`tuple`, optional
+        The ids of the files to return, handled like in :py:meth:`files`.
+    query : :py:class:`sqlalchemy.orm.query.Query`, optional
+        A query returning objects of the ``file_class`` of this database. Its
+        rows are returned in the query's order. Ignored if ``ids`` or
+        ``paths`` are given.
+    preserve_order : bool
+        See :py:meth:`files`. Only used together with ``ids`` or ``paths``.
+    paths : :obj:`list` or :obj:`tuple`, optional
+        The paths of the files to return, handled like in :py:meth:`reverse`.
+        Ignored if ``ids`` are given.
+
+    Returns
+    -------
+    :py:class:`bob.db.base.FileTable`
+        The selected files or, if no selection is given, all files of the
+        database in id order.
+    """
+
+    return FileTable.from_rows(self._rows(ids, paths, query, preserve_order))
+
+  def records(self, ids=None, query=None, preserve_order=True, paths=None):
+    """Returns read-only :py:class:`bob.db.base.FileRecord` objects
+
+    This is a fast path for callers that never modify the database: only the
+    ``id`` and ``path`` columns are read with SQLAlchemy Core, and immutable
+    records are created instead of ORM-mapped ``File`` objects. Records
+    support :py:meth:`bob.db.base.File.make_path`,
+    :py:meth:`bob.db.base.File.load` and are ordered by id.
+
+    For the parameters, see :py:meth:`file_table`.
+
+    Returns
+    -------
+    list
+        A list (that may be empty) of :py:class:`bob.db.base.FileRecord`.
+    """
+
+    rows = self._rows(ids, paths, query, preserve_order)
+    return [FileRecord(file_id, path) for file_id, path in rows]
 
   def uniquify(self, file_list):
     """Sorts the given list of File objects and removes duplicates from it.
@@ -359,6 +1218,69 @@ class SQLiteBaseDatabase(object):
 
     return self.uniquify(self.objects(**kwargs))
 
+  def stream(self, query, batch_size=1000):
+    """Iterates over the ``File`` objects of a query, sorted by id and
+    without duplicates, without loading all of them in memory.
+
+    Any ordering of the query is replaced by the file id, and rows are fetched
+    from the database in batches of ``batch_size`` (see
+    :py:meth:`sqlalchemy.orm.query.Query.yield_per`). Because the rows are
+    sorted, duplicates (e.g., caused by joins) are consecutive and are dropped
+    as they come.
+
+    Parameters
+    ----------
+    query : :py:class:`sqlalchemy.orm.query.Query`
+        A query returning objects of the ``file_class`` of this database,
+        normally built with :py:meth:`query`.
+    batch_size : :obj:`int`, optional
+        The number of rows fetched from the database at once.
+
+    Yields
+    ------
+    :py:class:`bob.db.base.File`
+        The objects returned by the query, in ascending id order.
+    """
+
+    id_column = self.m_file_class.id
+    last_id = None
+    for f in query.order_by(None).order_by(id_column).yield_per(batch_size):
+      if last_id is not None and f.id == last_id:
+        continue
+      last_id = f.id
+      yield f
+
+  def iter_all_files(self, batch_size=1000, **kwargs):
+    """Iterates over all File objects that satisfy your query.
+
+    This is the streaming counterpart of :py:meth:`all_files`. If the
+    implementation's ``objects()`` method returns a
+    :py:class:`sqlalchemy.orm.query.Query` (instead of a list), the files are
+    streamed with :py:meth:`stream`, so that memory usage does not grow with
+    the number of files. Otherwise, the returned list is sorted and
+    duplicates are skipped while iterating.
+
+    For possible keyword arguments, please check the implemention's
+    ``objects()`` method.
+    """
+
+    from sqlalchemy.orm import Query
+    objects = self.objects(**kwargs)
+    if isinstance(objects, Query):
+      return self.stream(objects, batch_size)
+    return _skip_duplicates(sorted(objects))
+
+
+def _skip_duplicates(sorted_files):
+  """Yields the given sorted files, skipping consecutive duplicate ids"""
+
+  last_id = None
+  for f in sorted_files:
+    if last_id is not None and f.id == last_id:
+      continue
+    last_id = f.id
+    yield f
+
 
 class SQLiteDatabase(SQLiteBaseDatabase, FileDatabase):
   """This class can be used for handling SQL **File** based databases.
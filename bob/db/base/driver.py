@@ -62,6 +62,105 @@ def dbshell_command(subparsers):
   parser.set_defaults(func=dbshell)
 
 
+def analyze(arguments):
+  """Explains representative queries and indexes fully scanned tables"""
+
+  if len(arguments.files) != 1:
+    raise RuntimeError(
+        "Something is wrong this database is supposed to be of type SQLite, "
+        "but you have more than one data file available: %s" %
+        arguments.files)
+
+  from .analyze import explain_queries, create_indexes
+
+  dbfile = arguments.files[0]
+  calls = arguments.queries()
+  if not calls:
+    print("The database `%s' does not declare representative queries to "
+          "analyze" % arguments.name)
+
+  suggestions = set()
+  for plan in explain_queries(dbfile, calls):
+    print(' '.join(plan.statement.split()))
+    for detail in plan.details:
+      print('  %s' % detail)
+    if plan.scans:
+      print('  ! full scan of table(s) %s' % ', '.join(plan.scans))
+    suggestions.update(plan.suggestions)
+
+  suggestions = sorted(suggestions)
+  for table, column in suggestions:
+    print("Missing index on %s(%s)" % (table, column))
+
+  if not arguments.create_indexes:
+    if suggestions:
+      print("Use --create-indexes to create the missing indexes and update "
+            "the statistics of `%s'" % dbfile)
+    return 0
+
+  if arguments.dryrun:
+    print("[dry-run] create %d index(es) and run ANALYZE on `%s'" %
+          (len(suggestions), dbfile))
+    return 0
+
+  created = create_indexes(dbfile, suggestions)
+  print("Created %d index(es) and updated the statistics of `%s'" %
+        (len(created), dbfile))
+  return 0
+
+
+def analyze_command(subparsers):
+  """Adds a new 'analyze' subcommand to your parser"""
+
+  parser = subparsers.add_parser('analyze', help=analyze.__doc__)
+  parser.add_argument("-c", "--create-indexes", dest="create_indexes",
+                      default=False, action='store_true',
+                      help="creates the missing indexes and runs ANALYZE on "
+                      "the database file")
+  parser.add_argument("-n", "--dry-run", dest="dryrun", default=False,
+                      action='store_true',
+                      help="does not actually run, just prints what would do instead")
+  parser.set_defaults(func=analyze)
+
+  return parser
+
+
+def pack(arguments):
+  """Packs original data files into a single file, for faster reading"""
+
+  from .pack import create, list_files
+
+  if arguments.dryrun:
+    members = list_files(arguments.directory, arguments.extensions)
+    print("[dry-run] pack %d files of `%s' into `%s'" %
+          (len(members), arguments.directory, arguments.output))
+    return 0
+
+  count = create(arguments.output, arguments.directory, arguments.extensions)
+  print("Packed %d files of `%s' into `%s'" %
+        (count, arguments.directory, arguments.output))
+  return 0
+
+
+def pack_command(subparsers):
+  """Adds a new 'pack' subcommand to your parser"""
+
+  parser = subparsers.add_parser('pack', help=pack.__doc__)
+  parser.add_argument("directory",
+                      help="the root directory of the original data files")
+  parser.add_argument("output", help="the pack file to create")
+  parser.add_argument("-e", "--extension", dest="extensions",
+                      action='append',
+                      help="only packs files with this extension (may be "
+                      "given several times) [default: all files]")
+  parser.add_argument("-n", "--dry-run", dest="dryrun", default=False,
+                      action='store_true',
+                      help="does not actually run, just prints what would do instead")
+  parser.set_defaults(func=pack)
+
+  return parser
+
+
 def upload(arguments):
   """Uploads generated metadata to the Idiap build server"""
 
@@ -410,24 +509,61 @@ class Interface(object):
     top_level.set_defaults(version=self.version())
     top_level.set_defaults(type=type)
     top_level.set_defaults(files=files)
+    top_level.set_defaults(queries=self.representative_queries)
 
     subparsers = top_level.add_subparsers(title="subcommands")
 
     # adds some stock commands
     version_command(subparsers)
 
+    if self.has_original_data():
+      pack_command(subparsers)
+
     if files:
       upload_command(subparsers)
       download_command(subparsers)
 
     if type in ('sqlite',):
       dbshell_command(subparsers)
+      analyze_command(subparsers)
 
     if files is not None:
       files_command(subparsers)
 
     return subparsers
 
+  def has_original_data(self):
+    '''Tells whether this database reads original data files
+
+    The ``pack`` command, which packs original data files into a single file
+    (see :py:mod:`bob.db.base.pack`), is only available for these databases.
+
+    Returns:
+
+      bool: ``True`` if the database has original data files. By default,
+      ``False``.
+
+    '''
+
+    return False
+
+  def representative_queries(self):
+    '''Representative queries of this database, to be analyzed
+
+    The ``analyze`` command, available for databases of type ``sqlite``,
+    runs these queries and checks whether the tables they use are indexed.
+    See :py:mod:`bob.db.base.analyze`.
+
+    Returns:
+
+      list: A list of functions without arguments, each running a typical
+      query of the database, e.g., ``lambda: Database().objects(protocol='P')``.
+      By default, no queries are declared.
+
+    '''
+
+    return []
+
   @abc.abstractmethod
   def add_commands(self, parser):
     '''Adds commands to a given :py:class:`argparse.ArgumentParser`
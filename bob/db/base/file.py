@@ -2,9 +2,125 @@
 # vim: set fileencoding=utf-8 :
 
 import os
+import functools
 
+import numpy
 import bob.io.base
 
+from . import aio, pack, storage
+
+
+def _hdf5_dataset(path):
+  """Returns the dtype, shape and offset of the only dataset of an HDF5 file,
+  or ``None`` if it cannot be memory-mapped"""
+
+  try:
+    import h5py
+  except ImportError:
+    return None
+
+  with h5py.File(path, 'r') as f:
+    datasets = []
+    f.visititems(lambda name, obj: datasets.append(obj)
+                 if isinstance(obj, h5py.Dataset) else None)
+    if len(datasets) != 1:
+      return None
+    dataset = datasets[0]
+    # only contiguous, unfiltered datasets are stored as a plain array
+    if dataset.chunks is not None or not dataset.shape or \
+            dataset.dtype.hasobject:
+      return None
+    offset = dataset.id.get_offset()
+    if offset is None:
+      return None
+    return dataset.dtype, dataset.shape, offset
+
+
+def memory_map(path):
+  """Memory-maps the array stored in a file, if its format allows it
+
+  The data is not read, but mapped read-only into memory, so that only the
+  parts that are accessed are loaded from disk. This is supported for
+  ``.npy`` files and, if :py:mod:`h5py` is installed, for HDF5 files
+  containing a single contiguous, uncompressed dataset.
+
+  Parameters
+  ----------
+  path : str
+      The file to map.
+
+  Returns
+  -------
+  :py:class:`numpy.ndarray` or ``None``
+      The read-only memory-mapped array, or ``None`` if the file cannot be
+      memory-mapped.
+  """
+
+  extension = os.path.splitext(path)[1].lower()
+  if extension == '.npy':
+    try:
+      return numpy.load(path, mmap_mode='r', allow_pickle=False)
+    except ValueError:
+      # e.g., arrays of objects
+      return None
+  if extension in ('.hdf5', '.h5', '.hdf'):
+    dataset = _hdf5_dataset(path)
+    if dataset is None:
+      return None
+    dtype, shape, offset = dataset
+    return numpy.memmap(path, dtype=dtype, mode='r', offset=offset,
+                        shape=shape)
+  return None
+
+
+def read_into(path, out):
+  """Reads the array stored in a ``.npy`` file directly into a given array
+
+  Parameters
+  ----------
+  path : str
+      The file to read.
+  out : :py:class:`numpy.ndarray`
+      The C-contiguous array to fill, with the shape and data type of the
+      stored array.
+
+  Returns
+  -------
+  bool
+      ``True`` if the data was read, ``False`` if the file is not a ``.npy``
+      file or does not match ``out``, in which case nothing was read.
+
+  Raises
+  ------
+  IOError
+      If the file is truncated.
+  """
+
+  if os.path.splitext(path)[1].lower() != '.npy' or \
+          not out.flags.c_contiguous or not out.flags.writeable:
+    return False
+  try:
+    f = open(path, 'rb')
+  except (OSError, IOError):
+    # e.g., a member of a pack
+    return False
+  with f:
+    version = numpy.lib.format.read_magic(f)
+    if version == (1, 0):
+      header = numpy.lib.format.read_array_header_1_0(f)
+    elif version == (2, 0):
+      header = numpy.lib.format.read_array_header_2_0(f)
+    else:
+      return False
+    shape, fortran_order, dtype = header
+    if fortran_order or dtype.hasobject or dtype != out.dtype or \
+            tuple(shape) != out.shape:
+      return False
+    count = f.readinto(out.reshape(-1).view(numpy.uint8))
+    if count != out.nbytes:
+      raise IOError("The file '%s' is truncated" % path)
+  return True
+
 
 class File(object):
   """Abstract class that define basic properties of File objects.
@@ -110,7 +226,8 @@ class File(object):
     # use the bob API to save the data
     bob.io.base.save(data, path, create_directories=create_directories)
 
-  def load(self, directory=None, extension='.hdf5'):
+  def load(self, directory=None, extension='.hdf5', mmap=False, cache=None,
+           out=None):
     """Loads the data at the specified location and using the given extension.
     Override it if you need to load differently.
 
@@ -118,10 +235,25 @@ class File(object):
     ----------
     directory : :obj:`str`, optional
         If not empty or None, this directory is prefixed to the final
-        file destination
+        file destination. This may also be a pack (see
+        :py:mod:`bob.db.base.pack`), from which the file is read, or a
+        :py:class:`bob.db.base.storage.TieredStorage`, whose local copy of
+        the file is read.
     extension : :obj:`str`, optional
         If not empty or None, this extension is suffixed to the final
         file destination
+    mmap : :obj:`bool`, optional
+        If set, the data is memory-mapped instead of read, when the file
+        format allows it (see :py:func:`memory_map`). Otherwise, the file is
+        read as usual.
+    cache : :py:class:`bob.db.base.cache.LoadCache`, optional
+        If given, the data is returned from this cache when the file was
+        loaded before and did not change since. Cached arrays are read-only.
+        Memory-mapped arrays are not cached.
+    out : :py:class:`numpy.ndarray`, optional
+        If given, the data is stored in this array, which must have the same
+        shape as the data, and this array is returned. Uncached ``.npy``
+        files are read directly into it; other data are copied into it.
 
     Returns
     -------
@@ -129,6 +261,108 @@ class File(object):
         The loaded data (normally :py:class:`numpy.ndarray`).
 
     """
-    # get the path
-    path = self.make_path(directory or '', extension or '')
-    return bob.io.base.load(path)
+    if isinstance(directory, storage.TieredStorage):
+      # the local copy is kept until it is read
+      return directory.read(
+          self.make_path('', extension or ''),
+          lambda root: self.load(root, extension, mmap, cache, out))
+    if out is not None:
+      if cache is None and not mmap and read_into(
+              self.make_path(directory or '', extension or ''), out):
+        return out
+      data = self.load(directory, extension, mmap, cache)
+      if numpy.shape(data) != out.shape:
+        raise ValueError("The shape %s of the data does not match the shape "
+                         "%s of the output array" % (numpy.shape(data),
+                                                     out.shape))
+      numpy.copyto(out, data)
+      return out
+
+    archive = pack.open_pack(directory)
+    if archive is not None:
+      member = self.make_path('', extension or '').replace(os.sep, '/')
+      path = os.path.join(archive.path, member)
+      read = functools.partial(archive.load, member)
+      source = archive.path
+    else:
+      # get the path
+      path = self.make_path(directory or '', extension or '')
+      if mmap:
+        data = memory_map(path)
+        if data is not None:
+          return data
+      read = functools.partial(bob.io.base.load, path)
+      source = None
+    if cache is not None:
+      return cache.load(path, read, source)
+    return read()
+
+  async def aload(self, directory=None, extension='.hdf5', **kwargs):
+    """Awaitable version of :py:meth:`load`, run in the file I/O executor of
+    :py:mod:`bob.db.base.aio`. Derived classes overriding :py:meth:`load` are
+    supported. Other keyword arguments (e.g., ``mmap``, ``cache`` or
+    ``out``) are passed to :py:meth:`load`."""
+
+    return await aio.run_io(self.load, directory, extension, **kwargs)
+
+  async def asave(self, data, directory=None, extension='.hdf5',
+                  create_directories=True):
+    """Awaitable version of :py:meth:`save`, see :py:meth:`aload`"""
+
+    return await aio.run_io(self.save, data, directory, extension,
+                            create_directories)
+
+
+class FileRecord(object):
+  """A lightweight, immutable counterpart of :py:class:`File`.
+
+  Records only hold the ``id`` and ``path`` of a file and are not attached to
+  any database session. They offer the same :py:meth:`make_path`,
+  :py:meth:`load` and :py:meth:`save` methods as :py:class:`File` and are
+  ordered by their id. Records are equal if both their ids and paths match.
+
+  Parameters
+  ----------
+  file_id : object
+      The id of the file.
+  path : str
+      The path to this file, relative to the basic directory and without
+      extension.
+  """
+
+  __slots__ = ('id', 'path')
+
+  def __init__(self, file_id, path):
+    object.__setattr__(self, 'id', file_id)
+    object.__setattr__(self, 'path', path)
+
+  def __setattr__(self, name, value):
+    raise AttributeError("FileRecord objects are read-only")
+
+  def __delattr__(self, name):
+    raise AttributeError("FileRecord objects are read-only")
+
+  def __reduce__(self):
+    return (FileRecord, (self.id, self.path))
+
+  def __eq__(self, other):
+    return isinstance(other, FileRecord) and \
+        (self.id, self.path) == (other.id, other.path)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return hash((self.id, self.path))
+
+  def __lt__(self, other):
+    return self.id < other.id
+
+  def __repr__(self):
+    return "<FileRecord('%s': '%s')>" % (str(self.id), str(self.path))
+
+  make_path = File.make_path
+  save = File.save
+  load = File.load
+  asave = File.asave
+  aload = File.aload
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Checksum manifests to verify the integrity of database files.
+
+A manifest records the size, modification time and SHA-256 digest of each
+file of a database, keyed by :py:attr:`bob.db.base.File.path`. Checking that
+files exist does not detect truncated or corrupted data, while hashing all
+files of a large database takes hours. Verification is therefore
+incremental: files whose size and modification time match the manifest are
+trusted, and only the others are hashed again, in parallel. For example:
+
+.. code-block:: python
+
+   from bob.db.base.manifest import Manifest
+   manifest = Manifest('/path/to/manifest.json')
+   manifest.update(db.objects(), directory, '.png')
+   manifest.save()
+   ...
+   result = manifest.verify(db.objects(), directory, '.png')
+   assert not result.missing and not result.corrupted
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import collections
+
+from . import utils
+
+
+Verification = collections.namedtuple(
+    'Verification', ('verified', 'missing', 'corrupted', 'unknown', 'hashed'))
+"""The result of :py:meth:`Manifest.verify`.
+
+The fields are lists of the paths (as in :py:attr:`bob.db.base.File.path`)
+of the files that are intact (``verified``), that do not exist
+(``missing``), whose contents differ from the manifest (``corrupted``) and
+that are not listed in the manifest (``unknown``). ``hashed`` is the number
+of files that had to be hashed."""
+
+
+def file_digest(path, chunk_size=2**20):
+  """Returns the SHA-256 digest of the contents of a file, in hexadecimal"""
+
+  digest = hashlib.sha256()
+  with open(path, 'rb') as f:
+    while True:
+      chunk = f.read(chunk_size)
+      if not chunk:
+        break
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def _stat(path):
+  """Returns the size and modification time of a file, or ``None``"""
+
+  try:
+    stat = os.stat(path)
+  except OSError:
+    return None
+  return stat.st_size, stat.st_mtime_ns
+
+
+def _describe(path):
+  """Returns the manifest entry of a file, hashing it"""
+
+  stat = _stat(path)
+  if stat is None:
+    return None
+  return {'size': stat[0], 'mtime_ns': stat[1], 'sha256': file_digest(path)}
+
+
+class Manifest(object):
+  """The size, modification time and digest of the files of a database.
+
+  Parameters
+  ----------
+  path : str
+      The JSON file storing the manifest. It is read if it exists.
+
+  Attributes
+  ----------
+  entries : dict
+      The entry of each file, keyed by its path relative to the root
+      directory and without extension. Each entry is a dictionary with the
+      ``size``, ``mtime_ns`` and ``sha256`` of the file.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.entries = {}
+    if os.path.exists(path):
+      with open(path, 'rt') as f:
+        self.entries = json.load(f)['files']
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __contains__(self, path):
+    return path in self.entries
+
+  def save(self):
+    """Writes the manifest, replacing the previous one atomically"""
+
+    directory = os.path.dirname(os.path.abspath(self.path))
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wt') as f:
+        json.dump({'version': 1, 'files': self.entries}, f, sort_keys=True,
+                  separators=(',', ':'))
+      os.replace(temporary, self.path)
+    except Exception:
+      os.unlink(temporary)
+      raise
+
+  def _changed(self, files, directory, extension, workers):
+    """Returns the files whose metadata differ from the manifest, with their
+    full paths and metadata"""
+
+    paths = utils.make_paths(files, directory, extension)
+    # on network file systems, the latency of each stat call dominates
+    stats = utils.parallel_map(_stat, paths, workers=workers)
+    changed = []
+    for f, path, stat in zip(files, paths, stats):
+      entry = self.entries.get(f.path)
+      if entry is None or stat is None or \
+              stat != (entry['size'], entry['mtime_ns']):
+        changed.append((f, path, stat))
+    return changed
+
+  def update(self, files, directory, extension, workers=None):
+    """Adds or refreshes the entries of the given files
+
+    Only new files and files whose size or modification time changed are
+    hashed. Missing files are removed from the manifest.
+
+    Parameters
+    ----------
+    files : list of :py:class:`bob.db.base.File`
+        The files to record.
+    directory : str
+        The root directory of the files.
+    extension : str
+        The extension of the files.
+    workers : :obj:`int`, optional
+        The number of files checked or hashed concurrently.
+
+    Returns
+    -------
+    int
+        The number of files that were hashed.
+    """
+
+    changed = self._changed(list(files), directory, extension, workers)
+    existing = []
+    for f, path, stat in changed:
+      if stat is None:
+        self.entries.pop(f.path, None)
+      else:
+        existing.append((f, path))
+    entries = utils.parallel_map(_describe, [p for _, p in existing],
+                                 workers=workers, on_error='skip')
+    for (f, _), entry in zip(existing, entries):
+      if entry is None:
+        # the file was removed or could not be read
+        self.entries.pop(f.path, None)
+      else:
+        self.entries[f.path] = entry
+    return len(existing)
+
+  def verify(self, files, directory, extension, workers=None):
+    """Verifies the integrity of the given files
+
+    Files whose size and modification time match the manifest are trusted.
+    The others are hashed, in parallel, and compared with the manifest. When
+    a file was only touched, i.e., its contents still match, its entry is
+    updated so it is not hashed again (use :py:meth:`save` to keep it).
+
+    Parameters
+    ----------
+    files : list of :py:class:`bob.db.base.File`
+        The files to verify.
+    directory : str
+        The root directory of the files.
+    extension : str
+        The extension of the files.
+    workers : :obj:`int`, optional
+        The number of files checked or hashed concurrently.
+
+    Returns
+    -------
+    :py:data:`Verification`
+        The result of the verification.
+    """
+
+    files = list(files)
+    changed = self._changed(files, directory, extension, workers)
+    unchanged = set(f.path for f in files) - set(f.path for f, _, _ in changed)
+
+    missing = []
+    unknown = []
+    rehash = []
+    for f, path, stat in changed:
+      if stat is None:
+        missing.append(f.path)
+      elif f.path not in self.entries:
+        unknown.append(f.path)
+      else:
+        rehash.append((f, path))
+
+    corrupted = []
+    verified = set(unchanged)
+    entries = utils.parallel_map(_describe, [p for _, p in rehash],
+                                 workers=workers, on_error='skip')
+    for (f, _), entry in zip(rehash, entries):
+      if entry is None:
+        missing.append(f.path)
+      elif entry['sha256'] == self.entries[f.path]['sha256']:
+        self.entries[f.path] = entry
+        verified.add(f.path)
+      else:
+        corrupted.append(f.path)
+
+    order = dict((f.path, i) for i, f in enumerate(files))
+    return Verification(sorted(verified, key=order.get),
+                        sorted(missing, key=order.get),
+                        sorted(corrupted, key=order.get),
+                        unknown, len(rehash))
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""A packed container format for the original data of databases.
+
+Reading millions of small files from a shared file system is dominated by
+metadata round-trips (lookups, opens and closes). A pack stores all files of
+a directory tree in a single large file, followed by an index of the offset
+and size of each member. Opening a pack reads its index once; members are
+then read with :py:func:`os.pread` from a single file descriptor, which can
+be shared between threads.
+
+Members are named after their path relative to the packed directory,
+including their extension, with ``/`` as separator. This is what
+:py:meth:`bob.db.base.File.make_path` returns for a relative directory, so a
+pack can replace the ``original_directory`` of a
+:py:class:`bob.db.base.FileDatabase`:
+
+.. code-block:: python
+
+   from bob.db.base.pack import create
+   create('/local/data.pack', '/shared/database/images', ['.png'])
+   db = Database(original_directory='/local/data.pack')
+
+The full path of a member, as returned by
+:py:meth:`bob.db.base.FileDatabase.original_file_name`, is the path of the
+pack joined with the name of the member, as if the pack was a directory.
+Packs can be created with the ``pack`` command of ``bob_dbmanage.py``.
+"""
+
+import io
+import os
+import json
+import struct
+import logging
+import tempfile
+import threading
+
+import numpy
+import bob.io.base
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b'BOBPACK1'
+"""The first bytes of pack files"""
+
+_HEADER = struct.Struct('<8sQQ')
+
+
+def is_pack(path):
+  """Tells if the given path is a pack file"""
+
+  try:
+    with open(path, 'rb') as f:
+      return f.read(len(MAGIC)) == MAGIC
+  except (OSError, IOError):
+    return False
+
+
+def list_files(directory, extensions=None):
+  """Lists the files below a directory, as sorted member names
+
+  Parameters
+  ----------
+  directory : str
+      The root directory of the files.
+  extensions : :obj:`list` of :obj:`str`, optional
+      If given, only files with one of these extensions are listed.
+  """
+
+  extensions = set(extensions or ())
+  members = []
+  for root, directories, files in os.walk(directory):
+    directories.sort()
+    for name in files:
+      if extensions and os.path.splitext(name)[1] not in extensions:
+        continue
+      relative = os.path.relpath(os.path.join(root, name), directory)
+      members.append(relative.replace(os.sep, '/'))
+  return sorted(members)
+
+
+def create(pack_file, directory, extensions=None, chunk_size=2**20):
+  """Packs the files of a directory tree into a single file
+
+  Members are stored in the order of their names, so that files of the same
+  directory are next to each other. The pack is written to a temporary file
+  that replaces ``pack_file`` once complete, so readers never see a partial
+  pack.
+
+  Parameters
+  ----------
+  pack_file : str
+      The path of the pack to create.
+  directory : str
+      The root directory of the files to pack.
+  extensions : :obj:`list` of :obj:`str`, optional
+      If given, only files with one of these extensions (e.g., ``.png``) are
+      packed.
+  chunk_size : :obj:`int`, optional
+      The size of the blocks copied at once, in bytes.
+
+  Returns
+  -------
+  int
+      The number of packed files.
+  """
+
+  members = list_files(directory, extensions)
+  target = os.path.dirname(os.path.abspath(pack_file))
+  fd, temporary = tempfile.mkstemp(dir=target, suffix='.tmp')
+  try:
+    with os.fdopen(fd, 'wb') as out:
+      out.write(_HEADER.pack(MAGIC, 0, 0))
+      index = []
+      for member in members:
+        offset = out.tell()
+        with open(os.path.join(directory, member), 'rb') as f:
+          while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+              break
+            out.write(chunk)
+        index.append((member, offset, out.tell() - offset))
+      index_offset = out.tell()
+      data = json.dumps(index, separators=(',', ':')).encode('utf-8')
+      out.write(data)
+      out.seek(0)
+      out.write(_HEADER.pack(MAGIC, index_offset, len(data)))
+    os.replace(temporary, pack_file)
+  except Exception:
+    os.unlink(temporary)
+    raise
+  logger.info("Packed %d files of '%s' into '%s'", len(members), directory,
+              pack_file)
+  return len(members)
+
+
+class PackFile(object):
+  """Random access to the members of a pack.
+
+  The pack is opened and its index is read once. Members are read with
+  :py:func:`os.pread`, so the same object can be used from several threads.
+  Pickled packs are re-opened when unpickled.
+
+  Parameters
+  ----------
+  path : str
+      The path of the pack.
+
+  Raises
+  ------
+  ValueError
+      If the file is not a pack.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._fd = os.open(path, os.O_RDONLY)
+    try:
+      magic, offset, size = _HEADER.unpack(
+          os.pread(self._fd, _HEADER.size, 0))
+      if magic != MAGIC:
+        raise ValueError("The file '%s' is not a pack" % path)
+      index = json.loads(os.pread(self._fd, size, offset).decode('utf-8'))
+    except Exception:
+      os.close(self._fd)
+      self._fd = None
+      raise
+    self._index = dict((m, (o, s)) for m, o, s in index)
+    self._order = [m for m, _, _ in index]
+
+  def __getstate__(self):
+    return {'path': self.path}
+
+  def __setstate__(self, state):
+    self.__init__(state['path'])
+
+  def __del__(self):
+    self.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def close(self):
+    """Closes the pack"""
+
+    if getattr(self, '_fd', None) is not None:
+      os.close(self._fd)
+      self._fd = None
+
+  def __len__(self):
+    return len(self._order)
+
+  def __iter__(self):
+    return iter(self._order)
+
+  def __contains__(self, member):
+    return member in self._index
+
+  def members(self):
+    """Returns the names of all members, in the order they are stored"""
+
+    return list(self._order)
+
+  def member(self, path):
+    """Returns the name of the member at the given path, or ``None``
+
+    Parameters
+    ----------
+    path : str
+        A member name, or a path below the pack, as returned by
+        :py:meth:`bob.db.base.File.make_path` with the pack as directory.
+    """
+
+    path = os.path.normpath(path)
+    prefix = os.path.join(os.path.normpath(self.path), '')
+    if path.startswith(prefix):
+      path = path[len(prefix):]
+    path = path.replace(os.sep, '/')
+    return path if path in self._index else None
+
+  def read(self, member):
+    """Returns the contents of a member, as :obj:`bytes`
+
+    Raises
+    ------
+    KeyError
+        If the member is not in the pack.
+    """
+
+    offset, size = self._index[member]
+    return os.pread(self._fd, size, offset)
+
+  def load(self, member):
+    """Loads the data of a member, like :py:func:`bob.io.base.load`
+
+    ``.npy`` members are decoded in memory. Other formats are loaded by
+    :py:func:`bob.io.base.load`, so that they are decoded exactly as the
+    unpacked files, from a temporary copy of the member. The copy is made in
+    memory-backed storage (``/dev/shm``) when available, so it does not
+    touch the disk.
+
+    Raises
+    ------
+    KeyError
+        If the member is not in the pack.
+    """
+
+    data = self.read(member)
+    extension = os.path.splitext(member)[1]
+    if extension.lower() == '.npy':
+      return numpy.load(io.BytesIO(data), allow_pickle=False)
+    with tempfile.NamedTemporaryFile(suffix=extension,
+                                     dir=_memory_directory()) as f:
+      f.write(data)
+      f.flush()
+      return bob.io.base.load(f.name)
+
+
+def _memory_directory():
+  """Returns a writable directory of a memory-backed file system, or ``None``
+  to use the default temporary directory"""
+
+  directory = '/dev/shm'
+  if os.path.isdir(directory) and os.access(directory, os.W_OK | os.X_OK):
+    return directory
+  return None
+
+
+_packs = {}
+_lock = threading.Lock()
+
+
+def open_pack(path):
+  """Returns the opened pack at the given path, or ``None`` if not a pack
+
+  Packs are opened once and kept open for the life time of the process.
+  Directories are remembered as such, so that repeated calls with the same
+  directory do not access the file system.
+
+  Parameters
+  ----------
+  path : str
+      The path of a pack, or of a directory.
+
+  Returns
+  -------
+  :py:class:`PackFile` or ``None``
+      The pack, or ``None`` if ``path`` is not a pack.
+  """
+
+  if not path:
+    return None
+  key = os.path.normpath(path)
+  with _lock:
+    if key in _packs:
+      return _packs[key]
+    if is_pack(key):
+      _packs[key] = PackFile(key)
+    elif os.path.isdir(key):
+      _packs[key] = None
+    else:
+      # missing paths may become packs later
+      return None
+    return _packs[key]
+
+
+def close_packs():
+  """Closes all packs opened by :py:func:`open_pack`, e.g., after they were
+  re-created"""
+
+  with _lock:
+    packs = [p for p in _packs.values() if p is not None]
+    _packs.clear()
+  for p in packs:
+    p.close()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Tiered storage of original data, with a local read-through cache.
+
+The original data of databases usually live on shared storage, which is slow
+to read from many compute nodes at once, while each node has a fast local
+disk. A :py:class:`TieredStorage` copies each file from the remote directory
+to a local directory the first time it is read, and reads the local copy
+afterwards. The local directory is kept below a maximum size by removing
+the least recently used copies, tracked in memory and checked against the
+local directory from time to time. Copies being read are pinned, so that
+they are not removed until the read is done. For example:
+
+.. code-block:: python
+
+   db = Database(original_directory=['/local/ssd/cache', '/shared/data'],
+                 storage_max_bytes=100 * 2**30)
+   path = db.original_file_name(f)  # a path in /local/ssd/cache
+
+Several processes can share the same local directory: copies are written to
+temporary files that are renamed once complete, so readers never see
+partial files. Pins only hold within a process: if another process removes a
+copy while it is read, :py:meth:`TieredStorage.read` reads the original file
+instead.
+"""
+
+import os
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import contextlib
+import collections
+
+logger = logging.getLogger(__name__)
+
+
+class TieredStorage(object):
+  """A remote directory read through a size-limited local copy.
+
+  Parameters
+  ----------
+  local : str
+      The local directory, where copies of the remote files are kept.
+  remote : str
+      The remote directory holding the original files.
+  max_bytes : int
+      The maximum total size of the local copies, in bytes.
+  low_water : :obj:`float`, optional
+      When the local copies exceed ``max_bytes``, the least recently used
+      ones are removed until they fit in this fraction of ``max_bytes``, so
+      that the following copies do not exceed it again right away.
+
+  Attributes
+  ----------
+  hits : int
+      The number of files read from the local directory.
+  misses : int
+      The number of files copied from the remote directory.
+  evictions : int
+      The number of local copies removed to stay within ``max_bytes``.
+  """
+
+  def __init__(self, local, remote, max_bytes, low_water=0.9):
+    if max_bytes <= 0:
+      raise ValueError("The size of the local storage must be positive, not "
+                       "%d" % max_bytes)
+    if not 0 < low_water <= 1:
+      raise ValueError("The low water mark must be in (0, 1], not %g" %
+                       low_water)
+    self.local = local
+    self.remote = remote
+    self.max_bytes = max_bytes
+    self.low_water = low_water
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    # the sizes of the local copies, from the least recently used, and their
+    # total; both are measured by scanning the local directory on the first
+    # fill, and again once as many files were copied as were found, so that
+    # copies made by other processes are accounted for
+    self._copies_lru = None
+    self._size = 0
+    self._fills = 0
+    # the local copies in use, with their number of users
+    self._pins = collections.Counter()
+    self._lock = threading.Lock()
+
+  def __getstate__(self):
+    return {'local': self.local, 'remote': self.remote,
+            'max_bytes': self.max_bytes, 'low_water': self.low_water}
+
+  def __setstate__(self, state):
+    self.__init__(state['local'], state['remote'], state['max_bytes'],
+                  state.get('low_water', 0.9))
+
+  def __repr__(self):
+    return "<TieredStorage('%s' -> '%s')>" % (self.remote, self.local)
+
+  def local_path(self, relative):
+    """Returns the path of the local copy of a file"""
+
+    return os.path.join(self.local, relative)
+
+  def remote_path(self, relative):
+    """Returns the path of the original file"""
+
+    return os.path.join(self.remote, relative)
+
+  def fetch(self, relative):
+    """Returns the path of the local copy of a file, copying it if required
+
+    The copy is not pinned, so that it may be removed by later fetches as soon
+    as this returns. Use :py:meth:`pinned` or :py:meth:`read` to keep it while
+    it is read.
+
+    Parameters
+    ----------
+    relative : str
+        The path of the file, relative to the remote directory.
+
+    Returns
+    -------
+    str
+        The path of the local copy.
+
+    Raises
+    ------
+    IOError
+        If the file cannot be found in the remote directory.
+    """
+
+    with self.pinned(relative) as path:
+      return path
+
+  def acquire(self, relative):
+    """Fetches a file and pins its local copy, until :py:meth:`release` is
+    called with the returned path
+
+    Parameters
+    ----------
+    relative : str
+        The path of the file, relative to the remote directory.
+
+    Returns
+    -------
+    str
+        The path of the local copy.
+
+    Raises
+    ------
+    IOError
+        If the file cannot be found in the remote directory.
+    """
+
+    path = self.local_path(relative)
+    # pinned before it is looked up, so that it cannot be removed in between
+    with self._lock:
+      self._pins[path] += 1
+    try:
+      self._fetch(relative, path)
+    except Exception:
+      self.release(path)
+      raise
+    return path
+
+  def release(self, path):
+    """Unpins a local copy returned by :py:meth:`acquire`"""
+
+    with self._lock:
+      self._pins[path] -= 1
+      if self._pins[path] <= 0:
+        del self._pins[path]
+
+  @contextlib.contextmanager
+  def pinned(self, relative):
+    """Fetches a file and yields the path of its local copy, which is not
+    removed until the context exits"""
+
+    path = self.acquire(relative)
+    try:
+      yield path
+    finally:
+      self.release(path)
+
+  def read(self, relative, read):
+    """Reads a file from its local copy, or from the original file if the copy
+    was removed by another process while it was read
+
+    Parameters
+    ----------
+    relative : str
+        The path of the file, relative to the remote directory.
+    read : callable
+        Called as ``read(directory)``, with the directory to read the file
+        from.
+
+    Returns
+    -------
+    object
+        The value returned by ``read``.
+    """
+
+    with self.pinned(relative) as path:
+      try:
+        return read(self.local)
+      except Exception:
+        if os.path.exists(path):
+          raise
+    logger.debug("The local copy '%s' was removed while it was read, reading "
+                 "the original file", path)
+    return read(self.remote)
+
+  def _fetch(self, relative, path):
+    """Copies a file to the local directory, unless it is already there"""
+
+    try:
+      stat = os.stat(path)
+    except OSError:
+      stat = None
+    if stat is not None:
+      # the access time orders the copies for eviction; the modification
+      # time stays the one of the original file
+      try:
+        os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+      except OSError:
+        pass
+      with self._lock:
+        self.hits += 1
+        if self._copies_lru is not None and path in self._copies_lru:
+          self._copies_lru.move_to_end(path)
+      return
+
+    size = self._copy(self.remote_path(relative), path)
+    with self._lock:
+      self.misses += 1
+      self._fills += 1
+      scan = self._copies_lru is None or self._fills > len(self._copies_lru)
+      if not scan:
+        self._size += size - self._copies_lru.pop(path, 0)
+        self._copies_lru[path] = size
+        if self._size > self.max_bytes:
+          self._shrink()
+    if scan:
+      self.evict()
+
+  @staticmethod
+  def _copy(source, target):
+    """Copies a file atomically, returning its size"""
+
+    directory, name = os.path.split(target)
+    os.makedirs(directory or '.', exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory or None,
+                                     prefix='.%s.' % name, suffix='.tmp')
+    os.close(fd)
+    try:
+      shutil.copy2(source, temporary)
+      os.utime(temporary, ns=(time.time_ns(),
+                              os.stat(temporary).st_mtime_ns))
+      os.replace(temporary, target)
+    except Exception:
+      if os.path.exists(temporary):
+        os.unlink(temporary)
+      raise
+    logger.debug("Copied '%s' to '%s'", source, target)
+    return os.stat(target).st_size
+
+  def _copies(self):
+    """Lists the local copies, as ``(access time, size, path)`` tuples"""
+
+    copies = []
+    for root, _, files in os.walk(self.local):
+      for name in files:
+        if name.startswith('.') and name.endswith('.tmp'):
+          # being written by another worker
+          continue
+        path = os.path.join(root, name)
+        try:
+          stat = os.stat(path)
+        except OSError:
+          continue
+        copies.append((stat.st_atime_ns, stat.st_size, path))
+    return copies
+
+  def _shrink(self, keep=None):
+    """Removes the least recently used known copies that are not pinned, until
+    they fit in the low water mark, with the lock held"""
+
+    target = self.low_water * self.max_bytes
+    if self._size <= self.max_bytes:
+      return
+    for path, size in list(self._copies_lru.items()):
+      if self._size <= target:
+        break
+      if path == keep or path in self._pins:
+        continue
+      try:
+        os.unlink(path)
+      except OSError:
+        # already removed by another worker
+        pass
+      del self._copies_lru[path]
+      self._size -= size
+      self.evictions += 1
+
+  def evict(self, keep=None):
+    """Scans the local copies, and removes the least recently used ones if
+    their total size exceeds ``max_bytes``
+
+    This is called automatically, from time to time, when files are fetched.
+    Pinned copies are never removed, so that the local copies may exceed
+    ``max_bytes`` while more than that is in use.
+
+    Parameters
+    ----------
+    keep : :obj:`str`, optional
+        A local copy that must not be removed, e.g., the one just fetched.
+
+    Returns
+    -------
+    int
+        The total size of the local copies, after eviction.
+    """
+
+    copies = self._copies()
+    with self._lock:
+      self._copies_lru = collections.OrderedDict(
+          (path, size) for _, size, path in sorted(copies))
+      self._size = sum(self._copies_lru.values())
+      self._fills = 0
+      self._shrink(keep)
+      return self._size
+
+  def exists(self, relative):
+    """Tells if a file exists in the local or in the remote directory"""
+
+    return os.path.exists(self.local_path(relative)) or \
+        os.path.exists(self.remote_path(relative))
+
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""A compact, column-oriented representation of lists of files.
+"""
+
+import numbers
+
+import numpy
+
+
+class FileTable(object):
+  """A compact table of file ids and paths.
+
+  This is a lightweight replacement of lists of :py:class:`bob.db.base.File`
+  objects, when only their ids and paths are required. Ids are kept in a
+  single :py:class:`numpy.ndarray` and paths are UTF-8 encoded into a single
+  contiguous byte buffer, together with the offsets of each path inside it.
+
+  Tables can be indexed like lists: an integer returns an ``(id, path)``
+  tuple, while slices, integer arrays and boolean masks return a new table.
+
+  Parameters
+  ----------
+  ids : array_like
+      The (integral) ids of the files.
+  paths : list of :obj:`str`
+      The paths of the files, relative to the root directory of the database
+      and without extension, in the same order as ``ids``.
+
+  Attributes
+  ----------
+  ids : :py:class:`numpy.ndarray`
+      The ids of the files, as a one-dimensional ``int64`` array.
+  """
+
+  def __init__(self, ids, paths):
+    encoded = [p.encode('utf-8') for p in paths]
+    lengths = numpy.fromiter((len(p) for p in encoded), dtype=numpy.int64,
+                             count=len(encoded))
+    offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=offsets[1:])
+    buffer = numpy.frombuffer(b''.join(encoded), dtype=numpy.uint8)
+    self._set(ids, buffer, offsets)
+
+  def _set(self, ids, buffer, offsets):
+    ids = numpy.asarray(ids, dtype=numpy.int64).ravel()
+    if len(ids) + 1 != len(offsets):
+      raise ValueError("The number of ids (%d) and paths (%d) differ" %
+                       (len(ids), len(offsets) - 1))
+    self.ids = ids
+    self._buffer = buffer
+    self._offsets = offsets
+
+  @classmethod
+  def _from_buffer(cls, ids, buffer, offsets):
+    table = cls.__new__(cls)
+    table._set(ids, buffer, offsets)
+    return table
+
+  @classmethod
+  def from_rows(cls, rows):
+    """Creates a table from an iterable of ``(id, path)`` pairs"""
+
+    ids = []
+    paths = []
+    for file_id, path in rows:
+      ids.append(file_id)
+      paths.append(path)
+    return cls(ids, paths)
+
+  @classmethod
+  def from_files(cls, files):
+    """Creates a table from an iterable of :py:class:`bob.db.base.File`"""
+
+    return cls.from_rows((f.id, f.path) for f in files)
+
+  def __len__(self):
+    return len(self.ids)
+
+  def __iter__(self):
+    return zip(self.ids.tolist(), self.paths())
+
+  def __repr__(self):
+    return "<FileTable with %d files>" % len(self)
+
+  def __getitem__(self, index):
+    if isinstance(index, numbers.Integral):
+      if index < 0:
+        index += len(self)
+      if not 0 <= index < len(self):
+        raise IndexError("FileTable index out of range")
+      return int(self.ids[index]), self.path(index)
+
+    if isinstance(index, slice) and index.step in (None, 1):
+      # contiguous ranges share the memory of this table
+      start, stop, _ = index.indices(len(self))
+      stop = max(start, stop)
+      offsets = self._offsets[start:stop + 1]
+      buffer = self._buffer[offsets[0]:offsets[-1]]
+      return self._from_buffer(self.ids[start:stop], buffer,
+                               offsets - offsets[0])
+
+    return self.take(numpy.arange(len(self))[index])
+
+  def path(self, index):
+    """Returns the path of the file at the given position"""
+
+    start, end = self._offsets[index], self._offsets[index + 1]
+    return self._buffer[start:end].tobytes().decode('utf-8')
+
+  def paths(self):
+    """Returns the paths of all files, as a list of :obj:`str`"""
+
+    data = self._buffer.tobytes()
+    offsets = self._offsets.tolist()
+    return [data[start:end].decode('utf-8')
+            for start, end in zip(offsets[:-1], offsets[1:])]
+
+  def take(self, indices):
+    """Returns a new table with the files at the given positions
+
+    Parameters
+    ----------
+    indices : array_like
+        The (integral) positions of the files to select, possibly repeated.
+
+    Returns
+    -------
+    :py:class:`FileTable`
+        The selected files, in the order of ``indices``.
+    """
+
+    indices = numpy.asarray(indices, dtype=numpy.int64)
+    starts = self._offsets[:-1][indices]
+    lengths = self._offsets[1:][indices] - starts
+    offsets = numpy.zeros(len(indices) + 1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=offsets[1:])
+    # gathers all selected bytes of the buffer in one go
+    positions = numpy.repeat(starts - offsets[:-1], lengths) + \
+        numpy.arange(offsets[-1], dtype=numpy.int64)
+    return self._from_buffer(self.ids[indices], self._buffer[positions],
+                             offsets)
+
+  def sorted(self):
+    """Returns a copy of this table, sorted by file id"""
+
+    return self.take(numpy.argsort(self.ids, kind='stable'))
+
+  def unique(self):
+    """Returns a copy of this table, sorted by file id and without duplicate
+    ids, similar to :py:func:`bob.db.base.utils.sort_files`"""
+
+    _, indices = numpy.unique(self.ids, return_index=True)
+    return self.take(indices)
+
+  def make_path(self, directory=None, extension=None):
+    """Builds the full paths of all files at once
+
+    This is the vectorized equivalent of :py:meth:`bob.db.base.File.make_path`,
+    see :py:meth:`bob.db.base.utils.PathList.array`.
+
+    Parameters
+    ----------
+    directory : :obj:`str`, optional
+        An optional directory name that will be prefixed to all paths.
+    extension : :obj:`str`, optional
+        An optional extension that will be suffixed to all paths.
+
+    Returns
+    -------
+    :py:class:`numpy.ndarray`
+        An array of :obj:`str` containing the full paths.
+    """
+
+    from .utils import PathList
+    return PathList(self.paths(), directory, extension).array()
@@ -16,7 +16,6 @@ database and allow you to interact with it via the command line.
 
 """
 
-import os
 import sys
 
 from bob.db.base.driver import Interface as AbstractInterface
@@ -46,13 +45,17 @@ def _checkfiles(args):
   """Checks the existence of the files based on your criteria."""
 
   from . import Database
+  from bob.db.base.utils import DirectoryIndex
   db = Database()
 
   r = db.objects(group=args.group)
 
-  # go through all files, check if they are available
-  bad = [f for f in r if not os.path.exists(f.make_path(
-      directory=args.directory, extension=args.extension))]
+  # go through all files, check if they are available, listing each
+  # directory once instead of checking every file
+  paths = [f.make_path(directory=args.directory, extension=args.extension)
+           for f in r]
+  exists = DirectoryIndex().exists_many(paths)
+  bad = [f for f, e in zip(r, exists) if not e]
 
   # report
   output = sys.stdout
@@ -70,6 +73,41 @@ def _checkfiles(args):
   return 0
 
 
+def _verify(args):
+  """Verifies the integrity of the files against a checksum manifest."""
+
+  from . import Database
+  from bob.db.base.manifest import Manifest
+  db = Database()
+
+  r = list(db.objects(group=args.group))
+  manifest = Manifest(args.manifest)
+
+  output = sys.stdout
+  if args.selftest:
+    from bob.db.base.utils import null
+    output = null()
+
+  if args.update:
+    hashed = manifest.update(r, args.directory, args.extension, args.workers)
+    manifest.save()
+    output.write('%d files (out of %d) were hashed into "%s"\n' %
+                 (hashed, len(r), args.manifest))
+    return 0
+
+  result = manifest.verify(r, args.directory, args.extension, args.workers)
+  for kind in ('missing', 'corrupted', 'unknown'):
+    for path in getattr(result, kind):
+      output.write('%s file "%s"\n' % (kind.capitalize(), path))
+  output.write('%d files (out of %d) were verified, %d were hashed\n' %
+               (len(result.verified), len(r), result.hashed))
+  if result.hashed:
+    # remembers the files that were only touched
+    manifest.save()
+
+  return 1 if result.missing or result.corrupted else 0
+
+
 class Interface(AbstractInterface):
   """Bob Manager interface for the Samples Database"""
 
@@ -107,6 +145,11 @@ class Interface(AbstractInterface):
 
     return 'builtin'
 
+  def has_original_data(self):
+    '''The samples are image files, which can be packed'''
+
+    return True
+
   def add_commands(self, parser):
     """A few commands this database can respond to."""
 
@@ -148,3 +191,29 @@ class Interface(AbstractInterface):
     check_parser.add_argument(
         '--self-test', dest="selftest", action='store_true', help=SUPPRESS)
     check_parser.set_defaults(func=_checkfiles)  # action
+
+    # add the verify command
+    verify_parser = subparsers.add_parser(
+        'verify', help="Verify the integrity of the files, based on a "
+        "checksum manifest")
+    verify_parser.add_argument(
+        'manifest', help="the manifest file storing the checksums")
+    verify_parser.add_argument(
+        '-d', '--directory', help="the path to the root directory to use "
+        "[default: <internal>]")
+    verify_parser.add_argument('-e', '--extension', default=".png",
+                               help="the extension appended to every sample "
+                               "[default: %(default)s]")
+    verify_parser.add_argument(
+        '-g', '--group', help="if given, this value will limit the output "
+        "files to those belonging to a particular group.",
+        choices=('train', 'test'))
+    verify_parser.add_argument(
+        '-u', '--update', action='store_true', help="creates or updates the "
+        "manifest, instead of verifying the files")
+    verify_parser.add_argument(
+        '-j', '--workers', type=int, help="the number of files hashed in "
+        "parallel")
+    verify_parser.add_argument(
+        '--self-test', dest="selftest", action='store_true', help=SUPPRESS)
+    verify_parser.set_defaults(func=_verify)  # action
@@ -147,3 +147,863 @@ def test02_database():
     del db
     db = TestDatabase()
     check_file(db.objects())
+
+
+def test03_bulk_lookup():
+    # check chunking, duplicates and missing keys in bulk lookups
+    db = TestDatabase()
+    db.lookup_chunk_size = 1
+
+    fs = db.files([1, 1, 1])
+    assert len(fs) == 3
+    assert all(f is fs[0] for f in fs)
+    assert len(db.files([1, 1], preserve_order=False)) == 1
+    assert len(db.reverse(["test/path", "test/path"])) == 2
+    assert db.files([1, 2], preserve_order=False)[0].id == 1
+    assert db.reverse(["unknown"], preserve_order=False) == []
+
+    try:
+        db.files([1, 2])
+        assert False, "KeyError not raised"
+    except KeyError:
+        pass
+
+
+def test04_file_cache():
+    # check that the object cache answers repeated lookups
+    db = bob.db.base.SQLiteDatabase(dbfile, TestFile, None, None,
+                                    cache_size=1)
+    f = db.files([1])[0]
+    assert db.reverse(["test/path"])[0] is f
+    assert db.paths([1])[0] == "test/path"
+    info = db.cache_info()
+    assert info.hits == 2
+    assert info.misses == 1
+    assert info.currsize == 1
+
+    from bob.db.base.cache import FileCache
+    cache = FileCache(1)
+    first = TestFile()
+    first.id = 1
+    cache.put(first)
+    other = TestFile()
+    other.id, other.path = 2, "other/path"
+    cache.put(other)
+    assert cache.get("test/path", "path") is None
+    assert cache.get(2) is other
+    assert cache.info().evictions == 1
+
+
+def test05_in_memory():
+    # check that an in-memory snapshot answers the same queries
+    db = bob.db.base.SQLiteDatabase(dbfile, TestFile, None, None,
+                                    in_memory=True)
+    f = db.files([1])[0]
+    assert f.path == "test/path"
+    assert f.client_id == 5
+    assert db.reverse(["test/path"])[0].id == 1
+
+
+def test06_lazy_session():
+    # check that sessions are only opened on the first query
+    import pickle
+    db = TestDatabase()
+    assert db.is_valid()
+    assert not db.is_open()
+    db = pickle.loads(pickle.dumps(db))
+    assert not db.is_open()
+    assert db.files([1])[0].path == "test/path"
+    assert db.is_open()
+
+    missing = bob.db.base.SQLiteDatabase(
+        dbfile + ".missing", TestFile, None, None)
+    assert not missing.is_valid()
+    try:
+        missing.files([1])
+        assert False, "IOError not raised"
+    except IOError:
+        pass
+
+
+def test07_thread_safe():
+    # check concurrent lookups from several threads
+    import threading
+    db = bob.db.base.SQLiteDatabase(dbfile, TestFile, None, None,
+                                    thread_safe=True, pool_size=2)
+    results = []
+
+    def lookup():
+        for _ in range(20):
+            results.append(db.files([1])[0].path)
+
+    threads = [threading.Thread(target=lookup) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ["test/path"] * 80
+
+
+def test08_streaming():
+    # check that files can be streamed from queries and from lists
+    db = TestDatabase()
+    query = db.query(TestFile).union_all(db.query(TestFile))
+    fs = list(db.stream(query, batch_size=1))
+    assert len(fs) == 1
+    assert fs[0].id == 1
+
+    fs = list(db.iter_all_files())
+    assert len(fs) == 1
+    assert fs[0].path == "test/path"
+
+
+def test09_file_table():
+    # check the columnar file table
+    import numpy
+    db = TestDatabase()
+    table = db.file_table()
+    assert len(table) == 1
+    assert table[0] == (1, "test/path")
+    assert list(db.file_table(ids=[1, 1]).ids) == [1, 1]
+    assert list(db.file_table(query=db.query(TestFile))) == [(1, "test/path")]
+
+    table = bob.db.base.FileTable([3, 1, 2, 1], ["c", "a", "b/x", "a"])
+    assert list(table[1:3]) == [(1, "a"), (2, "b/x")]
+    assert list(table[table.ids > 1]) == [(3, "c"), (2, "b/x")]
+    assert list(table.sorted().ids) == [1, 1, 2, 3]
+    assert list(table.unique()) == [(1, "a"), (2, "b/x"), (3, "c")]
+    paths = table.make_path("dir", ".png")
+    assert isinstance(paths, numpy.ndarray)
+    assert list(paths) == [os.path.join("dir", p + ".png")
+                           for p in ("c", "a", "b/x", "a")]
+
+
+def test10_records():
+    # check the ORM-free records
+    import pickle
+    db = TestDatabase()
+    records = db.records()
+    assert records == db.records(ids=[1]) == db.records(paths=["test/path"])
+    record = records[0]
+    assert isinstance(record, bob.db.base.FileRecord)
+    assert (record.id, record.path) == (1, "test/path")
+    assert record.make_path("dir", ".png") == os.path.join(
+        "dir", "test/path.png")
+    assert pickle.loads(pickle.dumps(record)) == record
+    assert sorted(set(records + db.records(ids=[1, 1]))) == records
+    try:
+        record.path = "other"
+        assert False, "AttributeError not raised"
+    except AttributeError:
+        pass
+
+
+def test11_memoize():
+    # check that query results are persistently memoized
+    from bob.db.base.cache import memoize
+    cache_dir = tempfile.mkdtemp(prefix="bob_db_test_")
+    calls = []
+
+    class MemoizedDatabase(TestDatabase):
+
+        @memoize(directory=cache_dir)
+        def objects(self, groups=None, protocol=None, purposes=None,
+                    model_ids=None):
+            calls.append(groups)
+            return list(self.query(TestFile))
+
+    try:
+        db = MemoizedDatabase()
+        for groups in ('group', ['group'], ('group',)):
+            fs = db.objects(groups=groups)
+            assert len(fs) == 1
+            assert isinstance(fs[0], TestFile)
+            assert fs[0].path == "test/path"
+        assert calls == ['group']
+        # results are shared with other instances
+        assert MemoizedDatabase().objects('group')[0].id == 1
+        assert len(calls) == 1
+        assert db.objects(groups='other')[0].id == 1
+        assert len(calls) == 2
+
+        # ids are not necessarily integral
+        class RecordDatabase(TestDatabase):
+
+            @memoize(directory=cache_dir)
+            def objects(self, groups=None, protocol=None, purposes=None,
+                        model_ids=None):
+                return [bob.db.base.FileRecord(i, "path/" + i)
+                        for i in ("abc", "001")]
+
+        for _ in range(2):
+            records = RecordDatabase().objects()
+            assert [r.id for r in records] == ["abc", "001"]
+            assert [r.path for r in records] == ["path/abc", "path/001"]
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test12_read_optimized():
+    # check the read-optimized connection profile
+    from sqlalchemy import text
+    db = bob.db.base.SQLiteDatabase(dbfile, TestFile, None, None,
+                                    connection_profile='read-optimized')
+    assert db.files([1])[0].path == "test/path"
+    query_only = db.m_session.execute(text("PRAGMA query_only")).scalar()
+    assert query_only == 1
+
+    try:
+        bob.db.base.utils.SQLiteConnector(dbfile, profile='unknown')
+        assert False, "ValueError not raised"
+    except ValueError:
+        pass
+
+
+def test13_analyze():
+    # check the query plan inspector
+    from bob.db.base.analyze import explain_queries, full_scans, \
+        create_indexes
+    assert full_scans(['SCAN file', 'SCAN TABLE client AS c',
+                       'SCAN file USING INDEX ix_file_path',
+                       'SEARCH file USING INTEGER PRIMARY KEY (rowid=?)',
+                       'SCAN CONSTANT ROW']) == ['file', 'c']
+
+    temp_dir = tempfile.mkdtemp(prefix="bob_db_test_")
+    try:
+        copy = os.path.join(temp_dir, "db.sql3")
+        shutil.copy(dbfile, copy)
+        db = bob.db.base.SQLiteDatabase(copy, TestFile, None, None)
+        plans = explain_queries(copy, [lambda: db.files([1])])
+        assert len(plans) == 1
+        assert not plans[0].scans
+        assert create_indexes(copy, [("file", "client_id")]) == \
+            ["ix_file_client_id"]
+
+        # columns of join conditions are suggested for indexing
+        from sqlalchemy import ForeignKey
+        from bob.db.base.driver import analyze
+        JoinBase = declarative_base()
+
+        class Client(JoinBase):
+            __tablename__ = "client"
+            id = Column(Integer, primary_key=True)
+            group = Column(String(10))
+
+        class JoinedFile(JoinBase, bob.db.base.File):
+            __tablename__ = "file"
+            id = Column(Integer, primary_key=True)
+            client_id = Column(Integer, ForeignKey("client.id"))
+            path = Column(String(100))
+
+        joined = os.path.join(temp_dir, "joined.sql3")
+        engine = bob.db.base.utils.create_engine_try_nolock("sqlite", joined)
+        JoinBase.metadata.create_all(engine)
+        engine.dispose()
+        db = bob.db.base.SQLiteDatabase(joined, JoinedFile, None, None)
+
+        def query():
+            return db.query(JoinedFile).join(Client).filter(
+                Client.group == "dev").all()
+        plans = explain_queries(joined, [query])
+        assert plans[0].scans == ["file"]
+        assert plans[0].suggestions == [("file", "client_id")]
+
+        # the stock driver command creates the missing indexes
+        class Namespace(object):
+            def __init__(self, **kwargs):
+                self.__dict__.update(kwargs)
+        arguments = Namespace(files=[joined], queries=lambda: [query],
+                              name="joined", create_indexes=True,
+                              dryrun=False)
+        assert analyze(arguments) == 0
+        details = explain_queries(joined, [query])[0].details
+        assert any("ix_file_client_id" in d for d in details)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test14_asyncio():
+    # check the awaitable queries and file I/O
+    import asyncio
+    import numpy
+    db = TestDatabase()
+    temp_dir = tempfile.mkdtemp(prefix="bob_db_test_")
+
+    async def run():
+        results = await asyncio.gather(
+            *([db.afiles([1]) for _ in range(8)] +
+              [db.areverse(["test/path"])]))
+        assert all(r[0].path == "test/path" for r in results)
+        paths = await db.apaths([1], "dir", ".ext")
+        assert paths == [os.path.join("dir", "test/path.ext")]
+        f = results[0][0]
+        await f.asave([1., 2., 3.], temp_dir)
+        data = await f.aload(temp_dir)
+        assert list(data) == [1., 2., 3.]
+        out = numpy.zeros(3)
+        assert await f.aload(temp_dir, out=out) is out
+        assert list(out) == [1., 2., 3.]
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+        shutil.rmtree(temp_dir)
+
+
+def test15_load_many():
+    # check the parallel loading of files
+    db = TestDatabase()
+    file = db.objects()[0]
+    temp_dir = tempfile.mkdtemp(prefix="bob_db_test_")
+    try:
+        file.save([1., 2., 3.], temp_dir)
+        missing = bob.db.base.FileRecord(2, "missing")
+        data = db.load_many([file, missing, file], temp_dir, ".hdf5",
+                            workers=2, on_error='skip')
+        assert len(data) == 3
+        assert list(data[0]) == [1., 2., 3.]
+        assert data[1] is None
+        assert list(data[2]) == [1., 2., 3.]
+        try:
+            db.load_many([missing], temp_dir, ".hdf5", retries=1)
+            assert False, "Loading a missing file should raise"
+        except (RuntimeError, IOError, OSError):
+            pass
+        db.original_directory = temp_dir
+        db.original_extension = ".hdf5"
+        assert list(db.load_many([file])[0]) == [1., 2., 3.]
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test16_prefetch():
+    # check the read-ahead iteration over files
+    db = TestDatabase()
+    file = db.objects()[0]
+    temp_dir = tempfile.mkdtemp(prefix="bob_db_test_")
+    try:
+        file.save([1., 2., 3.], temp_dir)
+        files = [file] * 10
+        pairs = list(db.prefetch(files, temp_dir, ".hdf5", depth=3))
+        assert len(pairs) == 10
+        assert all(f is file and list(d) == [1., 2., 3.] for f, d in pairs)
+        # stopping early
+        for i, (f, d) in enumerate(db.prefetch(iter(files), temp_dir,
+                                                     ".hdf5")):
+            if i == 2:
+                break
+        # skipping missing files
+        missing = bob.db.base.FileRecord(2, "missing")
+        pairs = list(db.prefetch([missing, file], temp_dir, ".hdf5",
+                                 on_error='skip'))
+        assert [f for f, _ in pairs] == [file]
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test17_memory_map():
+    # check memory-mapped loading, and the fallback to normal reads
+    import numpy
+    db = TestDatabase()
+    file = db.objects()[0]
+    temp_dir = tempfile.mkdtemp(prefix="bob_db_test_")
+    try:
+        array = numpy.arange(12.).reshape(3, 4)
+        os.makedirs(os.path.dirname(file.make_path(temp_dir)))
+        numpy.save(file.make_path(temp_dir, ".npy"), array)
+        data = file.load(temp_dir, ".npy", mmap=True)
+        assert isinstance(data, numpy.memmap)
+        assert not data.flags.writeable
+        assert (data == array).all()
+        data = db.load_many([file], temp_dir, ".npy", mmap=True)[0]
+        assert isinstance(data, numpy.memmap)
+        # other formats are mapped if possible, or read otherwise
+        file.save(array, temp_dir)
+        assert (file.load(temp_dir, mmap=True) == array).all()
+        assert bob.db.base.memory_map(file.make_path(temp_dir, ".bin")) is None
+
+        # overridden load methods are called without the mmap option
+        class Overriding(bob.db.base.FileRecord):
+            def load(self, directory=None, extension=None):
+                return bob.io.base.load(self.make_path(directory, extension))
+        overriding = Overriding(file.id, file.path)
+        data = db.load_many([overriding], temp_dir, ".hdf5", mmap=True)
+        assert (data[0] == array).all()
+        pairs = list(db.prefetch([overriding], temp_dir, ".hdf5", mmap=True))
+        assert (pairs[0][1] == array).all()
+        batch = db.load_batch([overriding] * 2, directory=temp_dir,
+                              extension=".hdf5", mmap=True)
+        assert (batch == array).all()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test18_directory_index():
+    # check existence checks from cached directory listings
+    from bob.db.base.utils import DirectoryIndex
+    db = TestDatabase()
+    file = db.objects()[0]
+    temp_dir = tempfile.mkdtemp(prefix="bob_db_test_")
+    try:
+        db.original_directory = temp_dir
+        db.original_extension = ".hdf5"
+        try:
+            db.original_file_name(file)
+            assert False, "A missing file should raise"
+        except ValueError:
+            pass
+        # new files are found after the directory changed
+        file.save([1., 2., 3.], temp_dir)
+        assert db.original_file_name(file) == file.make_path(temp_dir, ".hdf5")
+        assert db.original_file_names([file], check_existence=True) == \
+            [file.make_path(temp_dir, ".hdf5")]
+        db.check_existence = False
+        missing = bob.db.base.FileRecord(2, "test/missing")
+        assert db.original_file_name(missing)
+
+        class Unchecked(bob.db.base.FileDatabase):
+            check_existence = False
+        unchecked = Unchecked(temp_dir, ".hdf5")
+        assert unchecked.original_file_name(missing) == \
+            missing.make_path(temp_dir, ".hdf5")
+
+        index = DirectoryIndex(workers=2)
+        assert index.build(temp_dir) == 2
+        assert index.exists_many([file.make_path(temp_dir, ".hdf5"),
+                                  missing.make_path(temp_dir, ".hdf5"),
+                                  os.path.join(temp_dir, "none", "x")]) == \
+            [True, False, False]
+        os.remove(file.make_path(temp_dir, ".hdf5"))
+        assert index.exists_many([file.make_path(temp_dir, ".hdf5")]) == \
+            [False]
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test19_pack():
+    # check reading original data from a pack
+    from bob.db.base.pack import create, open_pack, close_packs
+    from bob.db.base.driver import pack
+    db = TestDatabase()
+    file = db.objects()[0]
+    temp_dir = tempfile.mkdtemp(prefix="bob_db_test_")
+    try:
+        data_dir = os.path.join(temp_dir, "data")
+        file.save([1., 2., 3.], data_dir)
+        with open(os.path.join(data_dir, "test", "other.txt"), "w") as f:
+            f.write("ignored")
+        pack_file = os.path.join(temp_dir, "data.pack")
+        assert create(pack_file, data_dir, [".hdf5"]) == 1
+        archive = open_pack(pack_file)
+        assert archive.members() == ["test/path.hdf5"]
+        assert open_pack(data_dir) is None
+
+        assert list(file.load(pack_file)) == [1., 2., 3.]
+        db.original_directory = pack_file
+        db.original_extension = ".hdf5"
+        assert db.original_file_name(file) == \
+            file.make_path(pack_file, ".hdf5")
+        assert archive.member(db.original_file_name(file)) == \
+            "test/path.hdf5"
+        data = db.load_many([file, file], workers=2)
+        assert all(list(d) == [1., 2., 3.] for d in data)
+        db.original_extension = ".png"
+        try:
+            db.original_file_name(file)
+            assert False, "A file missing from the pack should raise"
+        except ValueError:
+            pass
+
+        # members are loaded as bob.io.base.load loads the unpacked files
+        import numpy
+        from bob.db.base.pack import PackFile
+        image = numpy.arange(60, dtype=numpy.uint8).reshape(3, 4, 5)
+        bob.io.base.save(image, os.path.join(data_dir, "image.png"))
+        numpy.save(os.path.join(data_dir, "array.npy"), image)
+        image_pack = os.path.join(temp_dir, "image.pack")
+        create(image_pack, data_dir, [".png", ".npy"])
+        with PackFile(image_pack) as images:
+            expected = bob.io.base.load(os.path.join(data_dir, "image.png"))
+            assert (images.load("image.png") == expected).all()
+            assert (images.load("array.npy") == image).all()
+
+        # the stock driver command
+        class Namespace(object):
+            def __init__(self, **kwargs):
+                self.__dict__.update(kwargs)
+        close_packs()
+        assert pack(Namespace(directory=data_dir, output=pack_file,
+                              extensions=None, dryrun=False)) == 0
+        assert len(open_pack(pack_file)) == 4
+
+        # the command is only available for databases with original data
+        import argparse
+        from .sample.driver import Interface
+
+        class NoData(Interface):
+            def has_original_data(self):
+                return False
+        for interface, available in ((Interface(), True), (NoData(), False)):
+            parser = argparse.ArgumentParser()
+            subparsers = interface.setup_parser(
+                parser.add_subparsers(), "short", "long")
+            assert ("pack" in subparsers.choices) == available
+    finally:
+        close_packs()
+        shutil.rmtree(temp_dir)
+
+
+def test20_save_many():
+    # check the parallel, atomic saving of files
+    db = TestDatabase()
+    files = [bob.db.base.FileRecord(i, "dir%d/file%d" % (i % 2, i))
+             for i in range(6)]
+    temp_dir = tempfile.mkdtemp(prefix="bob_db_test_")
+    try:
+        data = [[float(i)] * 3 for i in range(6)]
+        paths = db.save_many(files, data, temp_dir, workers=3)
+        assert paths == [f.make_path(temp_dir, ".hdf5") for f in files]
+        loaded = db.load_many(files, temp_dir, ".hdf5")
+        assert [list(d) for d in loaded] == data
+        # saved files get the permissions allowed by the umask
+        umask = os.umask(0o027)
+        try:
+            path = db.save_many(files[:1], data[:1], temp_dir)[0]
+        finally:
+            os.umask(umask)
+        assert os.stat(path).st_mode & 0o777 == 0o640
+        # no temporary file is left over, also on errors
+        paths = db.save_many(files[:2], [None, [1.]], temp_dir,
+                             on_error='skip')
+        assert paths[0] is None and paths[1] is not None
+        assert sorted(os.listdir(os.path.join(temp_dir, "dir0"))) == \
+            ["file0.hdf5", "file2.hdf5", "file4.hdf5"]
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test21_make_paths():
+    # check the lazy construction of many paths
+    from bob.db.base.utils import make_paths, file_names, PathList
+    db = TestDatabase()
+    records = [bob.db.base.FileRecord(i, "dir/file%d" % i) for i in range(5)]
+    paths = make_paths(records, "root", ".ext")
+    assert isinstance(paths, PathList)
+    expected = [f.make_path("root", ".ext") for f in records]
+    assert paths == expected
+    assert paths[1:3] == expected[1:3]
+    assert list(paths.array()) == expected
+    assert file_names(records, None, None) == ["dir/file%d" % i
+                                               for i in range(5)]
+    assert isinstance(file_names(records, "root", ".ext"), list)
+    assert isinstance(file_names(records, "root", ".ext", lazy=True),
+                      PathList)
+    assert PathList(["/absolute"], "root", ".ext")[0] == "/absolute.ext"
+
+    # paths of the database are built from the path column
+    paths = db.paths([1, 1], "another/directory", ".other")
+    assert paths == ["another/directory/test/path.other"] * 2
+    assert isinstance(paths, list)
+    paths = db.paths([1, 1], "another/directory", ".other", lazy=True)
+    assert isinstance(paths, PathList)
+    assert paths == ["another/directory/test/path.other"] * 2
+
+    # overridden make_path methods are respected
+    class Custom(bob.db.base.File):
+        def make_path(self, directory=None, extension=None):
+            return "custom"
+    assert make_paths([Custom("a", 1)], "root") == ["custom"]
+
+
+def test22_load_cache():
+    # check the memory-budgeted cache of loaded data
+    import numpy
+    from bob.db.base.cache import LoadCache
+    db = TestDatabase()
+    db.load_cache = LoadCache(100)
+    files = [bob.db.base.FileRecord(i, "file%d" % i) for i in range(3)]
+    temp_dir = tempfile.mkdtemp(prefix="bob_db_test_")
+    try:
+        db.save_many(files, [numpy.zeros(5)] * 3, temp_dir)
+        first = db.load_many(files[:1], temp_dir, ".hdf5")[0]
+        assert not first.flags.writeable
+        assert db.load_many(files[:1], temp_dir, ".hdf5")[0] is first
+        assert files[0].load(temp_dir, cache=db.load_cache) is first
+        info = db.load_cache.info()
+        assert (info.hits, info.misses, info.currsize) == (2, 1, 40)
+        assert db.load_cache.hit_rate == 2. / 3.
+        # the byte budget evicts the least recently used arrays
+        db.load_many(files, temp_dir, ".hdf5")
+        assert len(db.load_cache) == 2
+        assert db.load_cache.info().evictions == 1
+        # modified files are loaded again
+        files[2].save(numpy.ones(2), temp_dir)
+        os.utime(files[2].make_path(temp_dir, ".hdf5"), ns=(1, 1))
+        assert list(db.load_many(files[2:], temp_dir, ".hdf5")[0]) == [1., 1.]
+
+        # overridden load methods are cached without the cache option
+        calls = []
+
+        class Overriding(bob.db.base.FileRecord):
+            def load(self, directory=None, extension=None):
+                calls.append(self.path)
+                return bob.io.base.load(self.make_path(directory, extension))
+        overriding = Overriding(0, "file0")
+        db.load_cache.clear()
+        first = db.load_many([overriding], temp_dir, ".hdf5")[0]
+        assert list(first) == [0.] * 5
+        assert list(db.prefetch([overriding], temp_dir, ".hdf5"))[0][1] is \
+            first
+        batch = db.load_batch([overriding], directory=temp_dir,
+                              extension=".hdf5")
+        assert (batch == 0).all()
+        assert calls == ["file0"]
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test23_manifest():
+    # check the incremental verification of files against a manifest
+    from bob.db.base.manifest import Manifest
+    db = TestDatabase()
+    files = [bob.db.base.FileRecord(i, "file%d" % i) for i in range(4)]
+    temp_dir = tempfile.mkdtemp(prefix="bob_db_test_")
+    try:
+        db.save_many(files[:3], [[float(i)] for i in range(3)], temp_dir)
+        manifest_file = os.path.join(temp_dir, "manifest.json")
+        manifest = Manifest(manifest_file)
+        assert manifest.update(files, temp_dir, ".hdf5", workers=2) == 3
+        manifest.save()
+
+        manifest = Manifest(manifest_file)
+        assert len(manifest) == 3
+        result = manifest.verify(files, temp_dir, ".hdf5")
+        assert result.verified == ["file0", "file1", "file2"]
+        assert result.missing == ["file3"]
+        assert result.hashed == 0
+        # touched files are hashed again, corrupted ones are detected
+        os.utime(files[0].make_path(temp_dir, ".hdf5"), ns=(1, 1))
+        with open(files[1].make_path(temp_dir, ".hdf5"), "r+b") as f:
+            f.truncate(10)
+        result = manifest.verify(files[:3], temp_dir, ".hdf5")
+        assert result.verified == ["file0", "file2"]
+        assert result.corrupted == ["file1"]
+        assert result.hashed == 2
+        assert manifest.verify(files[:1], temp_dir, ".hdf5").hashed == 0
+
+        # the verify command of the sample database
+        import argparse
+        from .sample.driver import Interface
+        parser = argparse.ArgumentParser()
+        Interface().add_commands(parser.add_subparsers())
+        sample_manifest = os.path.join(temp_dir, "sample.json")
+        for extra in (["--update"], []):
+            args = parser.parse_args(["samples", "verify", sample_manifest,
+                                      "--self-test"] + extra)
+            assert args.func(args) == 0
+        assert len(Manifest(sample_manifest)) == 6
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test24_load_batch():
+    # check loading samples into a preallocated batch
+    import numpy
+    from bob.db.base.file import read_into
+    db = TestDatabase()
+    files = [bob.db.base.FileRecord(i, "file%d" % i) for i in range(4)]
+    temp_dir = tempfile.mkdtemp(prefix="bob_db_test_")
+    try:
+        arrays = [numpy.full((2, 3), i, dtype=numpy.float64) for i in range(4)]
+        db.save_many(files, arrays, temp_dir)
+        batch = db.load_batch(files, directory=temp_dir, extension=".hdf5",
+                              workers=2)
+        assert batch.shape == (4, 2, 3)
+        assert all((batch[i] == i).all() for i in range(4))
+        again = db.load_batch(files[:2], directory=temp_dir,
+                              extension=".hdf5")
+        assert not numpy.shares_memory(batch, again)
+        # a buffer is reused by the following calls
+        from bob.db.base.utils import BatchBuffer
+        buffer = BatchBuffer()
+        batch = db.load_batch(files, buffer, temp_dir, ".hdf5", workers=2)
+        assert all((batch[i] == i).all() for i in range(4))
+        again = db.load_batch(files[:2], buffer, temp_dir, ".hdf5")
+        assert numpy.shares_memory(batch, again)
+        assert (again[1] == 1).all()
+        out = numpy.zeros((1, 2, 3))
+        assert db.load_batch(files[3:], out, temp_dir, ".hdf5") is out
+        assert (out == 3).all()
+
+        # .npy files are read directly into the output array
+        path = os.path.join(temp_dir, "array.npy")
+        numpy.save(path, arrays[2])
+        row = numpy.zeros((2, 3))
+        assert read_into(path, row)
+        assert (row == 2).all()
+        assert not read_into(path, numpy.zeros((3, 2)))
+        record = bob.db.base.FileRecord(5, "array")
+        row = out[0]
+        assert record.load(temp_dir, ".npy", out=row) is row
+        assert (out[0] == 2).all()
+        try:
+            db.load_batch([files[0]], numpy.zeros((1, 3, 3)), temp_dir,
+                          ".hdf5")
+            assert False, "Samples of a different shape should raise"
+        except ValueError:
+            pass
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test25_locality_order():
+    # check reading files by physical locality
+    from bob.db.base.utils import locality_order
+    assert locality_order(["b/2", "a/1", "b/1"]) == [1, 2, 0]
+    db = TestDatabase()
+    files = [bob.db.base.FileRecord(i, "dir%d/file%d" % (i % 3, i))
+             for i in range(9)]
+    temp_dir = tempfile.mkdtemp(prefix="bob_db_test_")
+    try:
+        db.save_many(files, [[float(i)] for i in range(9)], temp_dir)
+        for order in ("directory", "inode"):
+            data = db.load_many(files, temp_dir, ".hdf5", workers=2,
+                                order=order)
+            assert [d[0] for d in data] == list(range(9))
+            pairs = list(db.prefetch(files, temp_dir, ".hdf5", depth=4,
+                                     order=order))
+            assert [f for f, _ in pairs] == files
+            assert [d[0] for _, d in pairs] == list(range(9))
+            batch = db.load_batch(files, directory=temp_dir,
+                                  extension=".hdf5", order=order)
+            assert list(batch[:, 0]) == list(range(9))
+        # read-ahead hints are opt-in, also without a locality order
+        data = db.load_many(files, temp_dir, ".hdf5", read_ahead=True)
+        assert [d[0] for d in data] == list(range(9))
+        pairs = list(db.prefetch(files, temp_dir, ".hdf5", depth=4,
+                                 order="directory", read_ahead=True))
+        assert [d[0] for _, d in pairs] == list(range(9))
+        try:
+            db.load_many(files, temp_dir, ".hdf5", order="extent")
+            assert False, "An unknown order should raise"
+        except ValueError:
+            pass
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test26_tiered_storage():
+    # check reading original files through a local copy
+    import numpy
+    from bob.db.base.storage import TieredStorage
+    files = [bob.db.base.FileRecord(i, "dir/file%d" % i) for i in range(4)]
+    remote = tempfile.mkdtemp(prefix="bob_db_test_")
+    local = tempfile.mkdtemp(prefix="bob_db_test_")
+    try:
+        TestDatabase().save_many(files, [[float(i)] for i in range(4)], remote)
+        size = os.path.getsize(os.path.join(remote, "dir", "file0.hdf5"))
+        db = bob.db.base.FileDatabase([local, remote], ".hdf5",
+                                      storage_max_bytes=3 * size)
+        assert db.original_directory == remote
+        path = db.original_file_name(files[0])
+        assert path == os.path.join(local, "dir", "file0.hdf5")
+        assert os.path.exists(path)
+        assert db.storage.misses == 1
+        assert files[1].load(db.storage)[0] == 1.
+        assert [d[0] for d in db.load_many(files, workers=2)] == \
+            [0., 1., 2., 3.]
+        # the least recently used copies were evicted, down to 90% of the
+        # maximum size
+        assert db.storage.evictions == 2
+        assert len(os.listdir(os.path.join(local, "dir"))) == 2
+        assert not [n for n in os.listdir(os.path.join(local, "dir"))
+                    if n.endswith(".tmp")]
+        assert db.storage.hits + db.storage.misses == 6
+        try:
+            db.original_file_name(bob.db.base.FileRecord(9, "missing"))
+            assert False, "Missing files should raise"
+        except ValueError:
+            pass
+        try:
+            bob.db.base.FileDatabase([local], ".hdf5")
+            assert False, "Incomplete tiers should raise"
+        except ValueError:
+            pass
+
+        # the local directory is only scanned from time to time
+        storage = TieredStorage(local, remote, 3 * size)
+        scans = []
+        copies = storage._copies
+        storage._copies = lambda: scans.append(1) or copies()
+        for i in range(20):
+            storage.fetch(files[i % 4].make_path("", ".hdf5"))
+        assert storage.misses == 20
+        assert len(scans) <= 5
+        assert len(os.listdir(os.path.join(local, "dir"))) <= 3
+
+        # copies in use are not evicted by concurrent fetches
+        many = [bob.db.base.FileRecord(i, "many/file%d" % i)
+                for i in range(200)]
+        TestDatabase().save_many(
+            many, [numpy.full(100, float(f.id)) for f in many], remote)
+        size = os.path.getsize(many[0].make_path(remote, ".hdf5"))
+        db = bob.db.base.FileDatabase([local, remote], ".hdf5",
+                                      storage_max_bytes=4 * size)
+        data = db.load_many(many, workers=16, on_error="raise")
+        assert [d[0] for d in data] == list(range(200))
+        assert db.storage.evictions > 0
+        # all returned paths exist, even if they do not fit together
+        paths = db.original_file_names(many[:10])
+        assert all(os.path.exists(p) for p in paths)
+        assert not db.storage._pins
+    finally:
+        shutil.rmtree(remote)
+        shutil.rmtree(local)
+
+
+def test27_read_annotation_files():
+    # check reading many annotation files at once
+    import tarfile
+    types = ('eyecenter', 'named', 'idiap', 'json')
+    names = [bob.io.base.test_utils.datafile("%s.pos" % t, 'bob.db.base')
+             for t in types]
+    temp_dir = tempfile.mkdtemp(prefix="bob_db_test_")
+    try:
+        archive = os.path.join(temp_dir, "annotations.tar")
+        with tarfile.open(archive, "w") as tar:
+            for t, name in zip(types, names):
+                tar.add(name, "annotations/%s.pos" % t)
+        for t, name in zip(types, names):
+            expected = bob.db.base.read_annotation_file(name, t)
+            files = [name, None, os.path.join(temp_dir, "missing.pos"),
+                     archive + ":%s.pos" % t, archive + ":missing.pos",
+                     temp_dir + ":missing.pos"]
+            annotations = bob.db.base.read_annotation_files(files, t,
+                                                            workers=2)
+            assert annotations[0] == expected
+            assert annotations[1:3] == [None, None]
+            assert annotations[3] == expected
+            assert annotations[4:] == [None, None]
+            # the errors are returned with the annotations
+            annotations = bob.db.base.read_annotation_files(
+                files, t, workers=2, on_error="return")
+            assert annotations[:2] == [expected, None]
+            assert isinstance(annotations[2], IOError)
+            assert annotations[3] == expected
+            assert all(isinstance(a, IOError) for a in annotations[4:])
+        try:
+            bob.db.base.read_annotation_files(names, "unknown")
+            assert False, "Unknown annotation types should raise"
+        except ValueError:
+            pass
+        try:
+            bob.db.base.read_annotation_files(
+                [os.path.join(temp_dir, "missing.pos")], "named",
+                on_error="raise")
+            assert False, "Missing files should raise"
+        except IOError:
+            pass
+    finally:
+        shutil.rmtree(temp_dir)
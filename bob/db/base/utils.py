@@ -7,6 +7,14 @@
 """
 
 import os
+import logging
+import threading
+import itertools
+import collections
+import collections.abc
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
 
 
 class null(object):
@@ -56,8 +64,33 @@ class SQLiteConnector(object):
   lock : str
       Any vfs name as output by apsw.vfsnames()
 
+  in_memory : bool
+      If set, the database file is copied once into an in-memory SQLite
+      database using the SQLite backup API, and all queries are served from
+      memory afterwards. Changes are never written back to the file.
+
+  profile : str
+      The name of one of the :py:attr:`PROFILES`, which define URI parameters
+      and pragmas applied to every new connection. The ``read-optimized``
+      profile opens the file read-only and immutable (no locking and no
+      change detection), memory-maps it, enlarges the page cache and forbids
+      writes. Only use it for files that are never modified while opened.
+
   '''
 
+  PROFILES = {
+      'read-optimized': {
+          'uri': (('mode', 'ro'), ('immutable', '1')),
+          'pragmas': (
+              ('query_only', '1'),
+              ('mmap_size', str(2**30)),  # bytes
+              ('cache_size', str(-2**16)),  # negative values are in KiB
+              ('temp_store', 'MEMORY'),
+          ),
+      },
+  }
+  """Named sets of URI parameters and pragmas for opening connections"""
+
   @staticmethod
   def filesystem_is_lockable(database):
     """Checks if the filesystem is lockable"""
@@ -80,11 +113,17 @@ class SQLiteConnector(object):
 
   APSW_IS_AVAILABLE = apsw_is_available()
 
-  def __init__(self, filename, readonly=False, lock=None):
+  def __init__(self, filename, readonly=False, lock=None, in_memory=False,
+               profile=None):
 
+    if profile is not None and profile not in self.PROFILES:
+      raise ValueError("Unknown SQLite connection profile '%s'. Valid "
+                       "profiles are %s" % (profile, sorted(self.PROFILES)))
     self.readonly = readonly
     self.vfs = lock
     self.filename = filename
+    self.in_memory = in_memory
+    self.profile = profile
     self.lockable = SQLiteConnector.filesystem_is_lockable(self.filename)
 
     if (self.readonly or (self.vfs is not None)) and \
@@ -98,8 +137,69 @@ class SQLiteConnector(object):
           ' seem to support locks. I\'m returning a stock connection and '
           'hopping for the best.' % (filename,))
 
+  def uri(self, readonly=False):
+    """Returns the ``file:`` URI of the database, with the URI parameters of
+    the connection profile and, if requested, in read-only mode"""
+
+    from six.moves.urllib.parse import urlencode
+    from six.moves.urllib.request import pathname2url
+    parameters = collections.OrderedDict()
+    if readonly:
+      parameters['mode'] = 'ro'
+    if self.profile is not None:
+      parameters.update(self.PROFILES[self.profile]['uri'])
+    uri = 'file:%s' % pathname2url(os.path.abspath(self.filename))
+    if parameters:
+      uri += '?' + urlencode(parameters)
+    return uri
+
+  def snapshot(self):
+    """Returns a connection to an in-memory copy of the database file
+
+    The file is opened read-only and copied page by page with the SQLite
+    backup API, using apsw if available or the stock :py:mod:`sqlite3` module
+    otherwise.
+    """
+
+    from sqlite3 import connect
+
+    if self.APSW_IS_AVAILABLE:
+      import apsw
+      source = apsw.Connection(
+          self.uri(), vfs=self.vfs,
+          flags=apsw.SQLITE_OPEN_READONLY | apsw.SQLITE_OPEN_URI)
+      memory = apsw.Connection(':memory:')
+      try:
+        with memory.backup('main', source, 'main') as backup:
+          backup.step()  # copies all pages in one go
+      finally:
+        source.close()
+      return connect(memory)
+
+    source = connect(self.uri(readonly=True), uri=True)
+    memory = connect(':memory:', check_same_thread=False)
+    try:
+      source.backup(memory)
+    finally:
+      source.close()
+    return memory
+
   def __call__(self):
 
+    if self.in_memory:
+      connection = self.snapshot()
+    else:
+      connection = self.connect()
+
+    if self.profile is not None:
+      for name, value in self.PROFILES[self.profile]['pragmas']:
+        connection.execute('PRAGMA %s = %s' % (name, value))
+
+    return connection
+
+  def connect(self):
+    """Returns a new connection to the database file"""
+
     from sqlite3 import connect
 
     if (self.readonly or (self.vfs is not None)) and self.APSW_IS_AVAILABLE:
@@ -109,26 +209,61 @@ class SQLiteConnector(object):
         flags = apsw.SQLITE_OPEN_READONLY  # 1
       else:
         flags = apsw.SQLITE_OPEN_READWRITE | apsw.SQLITE_OPEN_CREATE  # 2|4
-      apsw_con = apsw.Connection(self.filename, vfs=self.vfs, flags=flags)
+      filename = self.filename
+      if self.profile is not None:
+        flags |= apsw.SQLITE_OPEN_URI
+        filename = self.uri()
+      apsw_con = apsw.Connection(filename, vfs=self.vfs, flags=flags)
       return connect(apsw_con)
 
+    if self.profile is not None:
+      return connect(self.uri(readonly=self.readonly), uri=True,
+                     check_same_thread=False)
+
     return connect(self.filename, check_same_thread=False)
 
-  def create_engine(self, echo=False):
-    """Returns an SQLAlchemy engine"""
+  def create_engine(self, echo=False, poolclass=None, pool_size=None):
+    """Returns an SQLAlchemy engine
+
+    Parameters
+    ----------
+    echo : :obj:`bool`, optional
+        If set, all SQL statements are logged.
+    poolclass : :obj:`type`, optional
+        A subclass of :py:class:`sqlalchemy.pool.Pool` that manages the
+        connections. By default, connections are not pooled, except for
+        in-memory databases, which share a single connection.
+    pool_size : :obj:`int`, optional
+        The number of connections kept open by ``poolclass``, for pools
+        supporting it (such as :py:class:`sqlalchemy.pool.QueuePool`).
+    """
 
     from sqlalchemy import create_engine
-    from sqlalchemy.pool import NullPool
+    from sqlalchemy.pool import NullPool, StaticPool
+    if poolclass is None:
+      # an in-memory copy must be made once and shared by all checkouts
+      poolclass = StaticPool if self.in_memory else NullPool
+    pool_options = {}
+    if pool_size is not None:
+      pool_options['pool_size'] = pool_size
     return create_engine('sqlite://',
                          creator=self,
                          echo=echo,
-                         poolclass=NullPool)
+                         poolclass=poolclass,
+                         **pool_options)
 
-  def session(self, echo=False):
-    """Returns an SQLAlchemy session"""
+  def session(self, echo=False, scoped=False, poolclass=None, pool_size=None):
+    """Returns an SQLAlchemy session
 
-    from sqlalchemy.orm import sessionmaker
-    Session = sessionmaker(bind=self.create_engine(echo))
+    If ``scoped`` is set, a :py:class:`sqlalchemy.orm.scoping.scoped_session`
+    is returned instead, which transparently keeps one session per thread.
+    For the other parameters, see :py:meth:`create_engine`.
+    """
+
+    from sqlalchemy.orm import sessionmaker, scoped_session
+    Session = sessionmaker(bind=self.create_engine(echo, poolclass, pool_size))
+    if scoped:
+      return scoped_session(Session)
     return Session()
 
 
@@ -144,13 +279,20 @@ def session(dbtype, dbfile, echo=False):
   return Session()
 
 
-def session_try_readonly(dbtype, dbfile, echo=False):
+def session_try_readonly(dbtype, dbfile, echo=False, in_memory=False,
+                         scoped=False, poolclass=None, pool_size=None,
+                         profile=None):
   """Creates a read-only session to an SQLite database.
 
   If read-only sessions are not supported by the underlying sqlite3 python DB
   driver, then a normal session is returned. A warning is emitted in case the
   underlying filesystem does not support locking properly.
 
+  If ``in_memory`` is set, the database file is copied into memory once and
+  the session is bound to that copy. If a connection ``profile`` is given, it
+  is applied to every connection (see :py:class:`SQLiteConnector`). The
+  remaining parameters are passed to :py:meth:`SQLiteConnector.session`.
+
 
   Raises:
 
@@ -162,8 +304,10 @@ def session_try_readonly(dbtype, dbfile, echo=False):
     raise NotImplementedError(
         "Read-only sessions are only currently supported for SQLite databases")
 
-  connector = SQLiteConnector(dbfile, readonly=True, lock='unix-none')
-  return connector.session(echo=echo)
+  connector = SQLiteConnector(dbfile, readonly=True, lock='unix-none',
+                              in_memory=in_memory, profile=profile)
+  return connector.session(echo=echo, scoped=scoped, poolclass=poolclass,
+                           pool_size=pool_size)
 
 
 def create_engine_try_nolock(dbtype, dbfile, echo=False):
@@ -461,8 +605,8 @@ def convert_names_to_lowlevel(names, low_level_names,
   return [mapping[g] for g in names]
 
 
-def file_names(files, directory, extension):
-  """file_names(files, directory, extension) -> paths
+def file_names(files, directory, extension, lazy=False):
+  """file_names(files, directory, extension, lazy=False) -> paths
 
   Returns the full path of the given File objects.
 
@@ -477,12 +621,119 @@ def file_names(files, directory, extension):
   extension : str
       The file name extension to add to all files.
 
+  lazy : :obj:`bool`, optional
+      If set, the paths may be returned as a lazy :py:class:`PathList`, see
+      :py:func:`make_paths`.
+
   Returns
   -------
   paths : list of :obj:`str`
       The paths extracted for the files, in the same order.
   """
   # return the paths of the files, do not remove duplicates
+  paths = make_paths(files, directory, extension)
+  if lazy or not isinstance(paths, PathList):
+    return paths
+  return paths.tolist()
+
+
+class PathList(collections.abc.Sequence):
+  """A lazy, read-only list of full file paths.
+
+  Paths are only built when they are accessed, from the relative path
+  (stem) of each file, a common directory and a common extension, as
+  :py:meth:`bob.db.base.File.make_path` would build them. This saves the
+  time and memory of building millions of strings that may never be used.
+
+  Parameters
+  ----------
+  stems : list of :obj:`str`
+      The paths of the files, relative to ``directory`` and without
+      extension.
+  directory : :obj:`str`, optional
+      The directory prefixed to all relative paths.
+  extension : :obj:`str`, optional
+      The extension suffixed to all paths.
+  """
+
+  def __init__(self, stems, directory=None, extension=None):
+    self._stems = stems
+    self._directory = directory
+    self._prefix = os.path.join(directory, '') if directory else ''
+    self._suffix = extension or ''
+
+  def _make(self, stem):
+    if self._prefix and stem.startswith(os.sep):
+      # like os.path.join, absolute paths discard the directory
+      return stem + self._suffix
+    return self._prefix + stem + self._suffix
+
+  def __len__(self):
+    return len(self._stems)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return PathList(self._stems[index], self._directory, self._suffix)
+    return self._make(self._stems[index])
+
+  def __iter__(self):
+    return map(self._make, self._stems)
+
+  def __eq__(self, other):
+    if not isinstance(other, collections.abc.Sequence) or \
+            isinstance(other, str):
+      return NotImplemented
+    return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+  def __ne__(self, other):
+    equal = self.__eq__(other)
+    return equal if equal is NotImplemented else not equal
+
+  def __repr__(self):
+    return "<PathList with %d paths>" % len(self)
+
+  def tolist(self):
+    """Returns all paths as a list of :obj:`str`"""
+
+    return list(self)
+
+  def array(self):
+    """Returns all paths as a :py:class:`numpy.ndarray` of :obj:`str`"""
+
+    import numpy
+    return numpy.array(self.tolist(), dtype=str)
+
+
+def make_paths(files, directory=None, extension=None):
+  """Returns the full paths of many files at once
+
+  If all files use the default :py:meth:`bob.db.base.File.make_path`, the
+  paths are returned as a lazy :py:class:`PathList`, built from the relative
+  paths of the files in one pass. Otherwise, the ``make_path`` method of each
+  file is called and a list is returned.
+
+  Parameters
+  ----------
+  files : list of :py:class:`bob.db.base.File`
+      The files, or any objects with a ``path`` attribute and a
+      ``make_path`` method.
+  directory : :obj:`str`, optional
+      The directory prefixed to all paths.
+  extension : :obj:`str`, optional
+      The extension suffixed to all paths.
+
+  Returns
+  -------
+  :py:class:`PathList` or list of :obj:`str`
+      The paths of the files, in the same order.
+  """
+
+  from .file import File
+
+  files = list(files)
+  classes = set(type(f) for f in files)
+  if all(getattr(c, 'make_path', None) is File.make_path for c in classes):
+    return PathList([f.path for f in files], directory, extension)
   return [f.make_path(directory, extension) for f in files]
 
 
@@ -506,3 +757,372 @@ def sort_files(files):
   # remove duplicates
   return [f for i, f in enumerate(sorted_files) if
           not i or sorted_files[i - 1].id != f.id]
+
+
+class _Retrying(object):
+  """Calls a function, retrying it a number of times if it raises"""
+
+  def __init__(self, function, retries):
+    self.function = function
+    self.retries = retries
+
+  def __call__(self, item):
+    for attempt in range(self.retries + 1):
+      try:
+        return self.function(item)
+      except Exception as e:
+        if attempt == self.retries:
+          raise
+        logger.debug("Retrying %r after error: %s", item, e)
+
+
+def parallel_imap(function, items, workers=None, depth=None, on_error='raise',
+                  retries=0, processes=False, schedule=None):
+  """Lazily applies a function to items in parallel, keeping their order
+
+  Items are only taken from ``items`` when there is room for them in the
+  window of ``depth`` calls running or waiting to be consumed, so that a
+  slow consumer holds back the workers. If the iteration is stopped early
+  (e.g., by ``break`` or by an exception), calls that did not start yet are
+  cancelled and the workers are shut down.
+
+  Parameters
+  ----------
+  function : callable
+      The function to apply to each item. If ``processes`` is set, it must be
+      picklable.
+  items : iterable
+      The items to process.
+  workers : :obj:`int`, optional
+      The number of threads (or processes). By default, the default of
+      :py:class:`concurrent.futures.ThreadPoolExecutor` (or
+      :py:class:`concurrent.futures.ProcessPoolExecutor`) is used.
+  depth : :obj:`int`, optional
+      The maximum number of items being processed or waiting to be consumed.
+      Defaults to twice the number of workers.
+  on_error : :obj:`str`, optional
+      What to do if the function raises for an item (after ``retries``): one
+      of ``raise`` (the exception is propagated) or ``skip`` (the error is
+      logged and ``None`` is produced for the item).
+  retries : :obj:`int`, optional
+      The number of times the function is retried for an item, if it raises.
+  processes : :obj:`bool`, optional
+      If set, a pool of processes is used instead of threads.
+  schedule : :obj:`callable`, optional
+      If given, items are taken in groups of about half the window and this
+      function is called with each group (a list) before it is submitted. It
+      returns the positions of the items of the group in the order they
+      should be processed, e.g., to follow the physical locality of files.
+      Results are still produced in the order of ``items``.
+
+  Yields
+  ------
+  object
+      The result of the function for each item, in the order of ``items``.
+
+  Raises
+  ------
+  ValueError
+      If ``on_error`` is not valid.
+  """
+
+  if on_error not in ('raise', 'skip'):
+    raise ValueError("The error policy should be one of 'raise' or 'skip', "
+                     "not '%s'" % on_error)
+
+  if workers is None:
+    # the defaults of the executors of concurrent.futures
+    cpus = os.cpu_count() or 1
+    workers = cpus if processes else min(32, cpus + 4)
+  if processes:
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+  else:
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+  if depth is None:
+    depth = 2 * workers
+  call = _Retrying(function, retries) if retries else function
+
+  def result(item, future):
+    try:
+      return future.result()
+    except Exception as e:
+      if on_error == 'raise':
+        raise
+      logger.warning("Skipping %r after error: %s", item, e)
+      return None
+
+  # without scheduling, the window is refilled one item at a time
+  threshold = max(1, depth // 2) if schedule else depth
+  iterator = iter(items)
+  pending = collections.deque()
+  try:
+    exhausted = False
+    while True:
+      if not exhausted and len(pending) < threshold:
+        group = list(itertools.islice(iterator, depth - len(pending)))
+        exhausted = not group
+        futures = [None] * len(group)
+        for i in (schedule(group) if schedule else range(len(group))):
+          futures[i] = executor.submit(call, group[i])
+        pending.extend(zip(group, futures))
+      if not pending:
+        break
+      yield result(*pending.popleft())
+  finally:
+    for _, future in pending:
+      future.cancel()
+    executor.shutdown(wait=True)
+
+
+def parallel_map(function, items, **kwargs):
+  """Applies a function to items in parallel, returning a list in the same
+  order. For the keyword arguments, see :py:func:`parallel_imap`."""
+
+  return list(parallel_imap(function, items, **kwargs))
+
+
+class BatchBuffer(object):
+  """A reusable array for batches of samples of the same shape.
+
+  Give it as ``out`` to :py:meth:`bob.db.base.FileDatabase.load_batch` to
+  build successive batches in the same memory. The array is allocated by the
+  first batch and only re-allocated when a batch has more samples, or
+  samples of another shape or data type. Each batch therefore overwrites
+  the previous one: use one buffer per thread or consumer.
+
+  Attributes
+  ----------
+  array : :py:class:`numpy.ndarray`
+      The allocated array, or ``None`` before the first batch.
+  """
+
+  def __init__(self):
+    self.array = None
+
+  def get(self, length, shape, dtype):
+    """Returns an array for ``length`` samples of the given shape and type
+
+    The returned array is a view of :py:attr:`array`, which is re-allocated
+    if it is too small or does not match.
+    """
+
+    import numpy
+    array = self.array
+    if array is None or array.dtype != dtype or \
+            array.shape[1:] != tuple(shape) or len(array) < length:
+      array = numpy.empty((length,) + tuple(shape), dtype=dtype)
+      self.array = array
+    return array[:length]
+
+
+class DirectoryIndex(object):
+  """Answers file existence questions from cached directory listings.
+
+  Instead of calling :py:func:`os.path.exists` for every file, which costs a
+  network round-trip per file on remote file systems, the contents of each
+  directory are listed once with :py:func:`os.scandir` and kept in memory,
+  together with the modification time of the directory. Files found in a
+  listing are trusted to exist. When a file is not found, the modification
+  time of its directory is checked and the directory is listed again if it
+  changed. Batch queries (:py:meth:`exists_many`) check each directory they
+  touch once, so they also notice removed files.
+
+  Directories are listed in parallel, either on demand or for a whole tree
+  with :py:meth:`build`. The index can be shared between threads.
+
+  Parameters
+  ----------
+  workers : :obj:`int`, optional
+      The number of directories listed concurrently.
+  """
+
+  def __init__(self, workers=None):
+    self.workers = workers
+    self._listings = {}
+    self._lock = threading.Lock()
+
+  def __getstate__(self):
+    return {'workers': self.workers}
+
+  def __setstate__(self, state):
+    self.__init__(state['workers'])
+
+  def __len__(self):
+    return len(self._listings)
+
+  def clear(self):
+    """Forgets all directory listings"""
+
+    with self._lock:
+      self._listings.clear()
+
+  @staticmethod
+  def _key(directory):
+    return os.path.normpath(os.path.abspath(directory))
+
+  def _scan(self, directory):
+    """Lists a directory, returning its sub-directories"""
+
+    try:
+      mtime = os.stat(directory).st_mtime_ns
+      names = set()
+      subdirectories = []
+      with os.scandir(directory) as entries:
+        for entry in entries:
+          names.add(entry.name)
+          try:
+            if entry.is_dir():
+              subdirectories.append(entry.path)
+          except OSError:
+            pass
+    except OSError:
+      # missing or unreadable directories contain nothing
+      mtime, names, subdirectories = None, frozenset(), []
+    with self._lock:
+      self._listings[directory] = (mtime, frozenset(names))
+    return subdirectories
+
+  def _validate(self, directory):
+    """Lists a directory again if it changed since it was listed"""
+
+    listing = self._listings.get(directory)
+    if listing is not None:
+      try:
+        mtime = os.stat(directory).st_mtime_ns
+      except OSError:
+        mtime = None
+      if mtime == listing[0]:
+        return
+    self._scan(directory)
+
+  def build(self, root):
+    """Lists all directories below ``root`` in parallel
+
+    Parameters
+    ----------
+    root : str
+        The top-level directory to index.
+
+    Returns
+    -------
+    int
+        The number of directories listed.
+    """
+
+    count = 0
+    level = [self._key(root)]
+    with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+      while level:
+        count += len(level)
+        subdirectories = executor.map(self._scan, level)
+        level = [d for s in subdirectories for d in s]
+    return count
+
+  def exists(self, path):
+    """Tells if a file (or directory) exists, using the cached listings"""
+
+    directory, name = os.path.split(self._key(path))
+    listing = self._listings.get(directory)
+    if listing is not None and name in listing[1]:
+      return True
+    self._validate(directory)
+    return name in self._listings[directory][1]
+
+  def exists_many(self, paths):
+    """Tells which of the given files exist
+
+    Each directory containing one of the files is listed or checked for
+    modifications once, in parallel.
+
+    Parameters
+    ----------
+    paths : iterable of :obj:`str`
+        The paths of the files.
+
+    Returns
+    -------
+    list of :obj:`bool`
+        Whether each file exists, in the same order as ``paths``.
+    """
+
+    splits = [os.path.split(self._key(p)) for p in paths]
+    directories = list(set(d for d, _ in splits))
+    with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+      list(executor.map(self._validate, directories))
+    listings = self._listings
+    return [name in listings[directory][1] for directory, name in splits]
+
+
+def _inode(path):
+  try:
+    stat = os.stat(path)
+  except OSError:
+    # missing files are read last
+    return (1, 0, 0)
+  return (0, stat.st_dev, stat.st_ino)
+
+
+def locality_order(paths, order='directory', workers=None):
+  """Returns the order in which files should be read to follow their
+  physical locality
+
+  On spinning disks and network storage, reading files in a random order
+  costs a seek or a round-trip per file. Files of the same directory, and
+  files with close inode numbers, are usually stored close to each other and
+  benefit from the read-ahead of the storage.
+
+  Parameters
+  ----------
+  paths : list of :obj:`str`
+      The paths of the files.
+  order : :obj:`str`, optional
+      Either ``directory``, to read files directory by directory, or
+      ``inode``, to read them by increasing inode number on each device,
+      which requires a :py:func:`os.stat` call per file.
+  workers : :obj:`int`, optional
+      The number of files checked concurrently for the ``inode`` order.
+
+  Returns
+  -------
+  list of :obj:`int`
+      The positions of the files in ``paths``, in the order to read them.
+
+  Raises
+  ------
+  ValueError
+      If ``order`` is not valid.
+  """
+
+  if order == 'directory':
+    keys = [os.path.split(p) for p in paths]
+  elif order == 'inode':
+    keys = parallel_map(_inode, paths, workers=workers) if paths else []
+  else:
+    raise ValueError("The order should be one of 'directory' or 'inode', "
+                     "not '%s'" % order)
+  return sorted(range(len(keys)), key=keys.__getitem__)
+
+
+def advise_willneed(paths):
+  """Tells the operating system that the given files will be read soon, so
+  that it starts loading them into the page cache
+
+  This uses :py:func:`os.posix_fadvise` where available, and does nothing
+  otherwise. Each file is opened and closed once more for the hint, which
+  costs a round-trip per file on network file systems. Files that cannot be
+  opened are ignored.
+  """
+
+  if not hasattr(os, 'posix_fadvise'):
+    return
+  for path in paths:
+    try:
+      fd = os.open(path, os.O_RDONLY)
+    except OSError:
+      continue
+    try:
+      os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+      pass
+    finally:
+      os.close(fd)